@@ -0,0 +1,222 @@
+"""
+Micro-benchmarks of the simulator primitives of main.py on a corpus of recorded positions.
+
+    python benchmark.py                  # ops/sec against the stored baselines
+    python benchmark.py --save           # store the results as the new baselines
+    python benchmark.py --check          # exit with 1 if a primitive is slower than its baseline
+
+The positions are turn inputs as the referee sends them, in benchmarks/positions. For each primitive the report
+gives ops/sec, the ratio to the baseline, the peak memory traced while it runs and the memory it keeps per op.
+The rollouts line is the rollout engine end to end: complete uniform random turns played and scored one-ply in
+100ms by Agent.random_think. The search line is the same search with the bot's own settings, its rollout policy
+and its two-ply replies (TWO_PLY), so a slower search shows apart from a slower engine.
+Ops/sec depend on the machine, store the baselines on the box the bot is checked on before comparing to them.
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+POSITIONS_DIR = os.path.join(BENCHMARK_DIR, 'positions')
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+MIN_TIME_SECONDS = 0.2  # a measure runs the primitive at least this long
+REPEATS = 5  # measures of a primitive, the best one is kept
+ALLOCATION_OPS = 100  # ops run under tracemalloc
+ROLLOUT_SECONDS = 0.1
+READ_BATCH = 1000  # copies of a position in the input of the read benchmark
+TOLERANCE = 0.25  # --check fails below (1 - TOLERANCE) times the baseline
+ENGINE_SETTINGS = {'TWO_PLY': False, 'ROLLOUT_PRIORITY': None}  # the rollouts line: uniform rollouts, no replies
+
+
+def load_bot(path):
+    spec = importlib.util.spec_from_file_location('bot', path)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot
+
+
+def set_stdin(text):
+    sys.stdin = io.TextIOWrapper(io.BytesIO(text.encode()))
+
+
+def load_agent(bot, text):
+    set_stdin(text)
+    agent = bot.Agent()
+    agent.read()
+    return agent
+
+
+def ops_per_second(op):
+    """
+    Best of REPEATS measures, each one calling op() in a loop for at least MIN_TIME_SECONDS
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            op()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME_SECONDS / 10: break
+        loops *= 4
+    loops = max(1, int(loops * MIN_TIME_SECONDS / elapsed))
+
+    best = 0.0
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(loops):
+            op()
+        best = max(best, loops / (time.perf_counter() - start))
+    return best
+
+
+def allocations(op):
+    """
+    (peak KiB traced while running ALLOCATION_OPS ops, bytes still allocated per op afterwards)
+    """
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for _ in range(ALLOCATION_OPS):
+        op()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak - start) / 1024, (current - start) / ALLOCATION_OPS
+
+
+def primitives(bot, text):
+    """
+    The primitives measured on a position, by name. A primitive is an op() and the number of operations it does
+    """
+    agent = load_agent(bot, text)
+    state = agent.state
+    result = {}
+
+    # Agent.read, the input holds the position READ_BATCH times so every op parses it again
+    reads_left = [0]
+
+    def read():
+        if reads_left[0] == 0:
+            set_stdin(text * READ_BATCH)
+            agent.reader = bot.InputReader()
+            reads_left[0] = READ_BATCH
+        reads_left[0] -= 1
+        agent.read()
+    result['read'] = (read, 1)
+    if state.isInDraft(): return result
+
+    actions = list(state.generateActions())
+    result['generateActions'] = (state.generateActions, 1)
+
+    def update_action():
+        for action in actions:
+            state.update_action(action)
+            state.undo()
+    if actions: result['update_action+undo'] = (update_action, len(actions))
+    result['clone'] = (state.clone, 1)
+    result['eval_score'] = (lambda: agent.eval_score(state), 1)
+    return result
+
+
+def rollouts(bot, text, settings=None):
+    """
+    Median number of random turns Agent.random_think plays in ROLLOUT_SECONDS, with the bot's module-level
+    constants set to settings meanwhile
+    """
+    settings = settings or {}
+    missing = object()
+    saved = {name: getattr(bot, name, missing) for name in settings}
+    for name, value in settings.items():
+        setattr(bot, name, value)
+    try:
+        return rollout_count(bot, text)
+    finally:
+        for name, value in saved.items():
+            if value is missing:
+                delattr(bot, name)
+            else:
+                setattr(bot, name, value)
+
+
+def rollout_count(bot, text):
+    counts = []
+    for _ in range(REPEATS):
+        agent = load_agent(bot, text)
+        count = [0]
+        undo_all = agent.state.undo_all
+
+        def counting_undo_all():
+            count[0] += 1
+            undo_all()
+        agent.state.undo_all = counting_undo_all
+        agent.timeout.start()
+        agent.timeout.deadline_ns = agent.timeout.start_ns + int(ROLLOUT_SECONDS * 1e9)
+        agent.random_think()
+        counts.append(count[0])
+    return statistics.median(counts)
+
+
+def report(primitive, position, value, baselines, tolerance, regressions, extra):
+    key = primitive + '/' + position
+    baseline = baselines.get(key)
+    ratio = value / baseline if baseline else float('nan')
+    if baseline and ratio < 1 - tolerance: regressions.append(key)
+    print("{:<20} {:<10} {:>12.1f} {:>12} {:>7.2f} {}".format(
+        primitive, position, value, "{:.1f}".format(baseline) if baseline else "-", ratio, extra))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulator primitives of a bot")
+    parser.add_argument('--bot', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'))
+    parser.add_argument('--save', action='store_true', help="store the results as the baselines")
+    parser.add_argument('--check', action='store_true', help="exit with 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    bot = load_bot(args.bot)
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = []
+    print("{:<20} {:<10} {:>12} {:>12} {:>7} {:>9} {:>11}".format(
+        "primitive", "position", "ops/s", "baseline", "ratio", "peak KiB", "kept B/op"))
+    for name in sorted(os.listdir(POSITIONS_DIR)):
+        position = os.path.splitext(name)[0]
+        with open(os.path.join(POSITIONS_DIR, name)) as f:
+            text = f.read()
+
+        measures = primitives(bot, text)
+        for primitive, (op, size) in measures.items():
+            ops = ops_per_second(op) * size
+            peak, kept = allocations(op)
+            results[primitive + '/' + position] = ops
+            report(primitive, position, ops, baselines, args.tolerance, regressions,
+                   "{:>9.1f} {:>11.1f}".format(peak, kept / size))
+
+        if 'generateActions' in measures:
+            for primitive, settings in (('rollouts/100ms', ENGINE_SETTINGS), ('search/100ms', None)):
+                count = rollouts(bot, text, settings)
+                results[primitive + '/' + position] = count
+                report(primitive, position, count, baselines, args.tolerance, regressions, "")
+
+    sys.stdin = sys.__stdin__
+    if args.save:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({key: round(value, 1) for key, value in sorted(results.items())}, f, indent=2)
+            f.write('\n')
+        print("baselines saved to " + BASELINE_PATH)
+    if regressions:
+        print("slower than the baseline: " + ", ".join(regressions))
+        if args.check: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
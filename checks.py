@@ -0,0 +1,194 @@
+"""
+Brute-force checks of the search shortcuts of main.py on random positions: each one is compared to an exhaustive
+search over the legal actions of State.generateActions().
+
+    python checks.py                     # every check
+    python checks.py canonical --positions 1000 --seed 7
+
+canonical   the canonical move ordering (State.canonical_actions()) reaches every end-of-turn position the legal
+            actions reach, and only those
+lethal      LethalSolver finds a kill whenever the legal actions have one, and the turn it returns is legal and kills
+combat      the attacks Agent.plan_attacks() plans with CombatPlanner are legal and reach the best Agent.eval_score()
+            of any sequence of attacks
+
+The positions are turn inputs as the referee sends them, with cards of its procedural pool. A failure prints its
+input, which Agent.read() parses back. The exit status is 1 if a check failed.
+"""
+import argparse
+import importlib.util
+import io
+import os
+import random
+import sys
+import time
+
+import referee
+
+POSITIONS = 300  # positions tried by each check
+NO_DEADLINE_NS = 3600 * 10 ** 9  # the solvers checked get this long, their time bound is not what is checked
+KEYWORD_CHANCE = 0.3  # chance a creature on the board gets one more random keyword
+
+
+def load_bot(path):
+    spec = importlib.util.spec_from_file_location('bot', path)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot
+
+
+def load_agent(bot, text):
+    sys.stdin = io.TextIOWrapper(io.BytesIO(text.encode()))
+    agent = bot.Agent()
+    agent.read()
+    return agent
+
+
+def position(cards, rng, hand, mine, opponent, mana, opponent_hp):
+    """
+    Turn input of a battle turn: hand random cards in my hand, mine and opponent random creatures on the boards
+    """
+    creatures = [card for card in cards if card.card_type == referee.CREATURE]
+    lines = []
+    for k in range(hand + mine + opponent):
+        if k < hand:
+            instance, location = referee.CardInstance(rng.choice(cards), k + 1), referee.IN_HAND
+        else:
+            instance = referee.CardInstance(rng.choice(creatures), k + 1)
+            location = referee.MY_BOARD if k < hand + mine else referee.OPPONENT_BOARD
+            if rng.random() < KEYWORD_CHANCE: instance.keywords |= 1 << rng.randrange(len(referee.ABILITY_LETTERS))
+        lines.append(instance.line(location))
+    return "30 {} 20 25 1\n{} {} 20 25 1\n5 0\n{}\n{}\n".format(mana, opponent_hp, mana, len(lines), '\n'.join(lines))
+
+
+def end_positions(bot, state, actions):
+    """
+    Hashes of the positions where nothing is playable, reached by playing actions(state) in every order
+    """
+    seen = set()
+    ends = set()
+
+    def visit():
+        # the canonical actions depend on the last action too
+        key = (state.hash, state.data[bot.LAST_ACTION], state.data[bot.LAST_INTERACTS])
+        if key in seen: return
+        seen.add(key)
+        if not state.count_actions():
+            ends.add(state.hash)
+            return
+        for action in list(actions(state)):
+            state.update_action(action)
+            visit()
+            state.undo()
+
+    visit()
+    return ends
+
+
+def check_canonical(bot, cards, rng):
+    text = position(cards, rng, hand=rng.randint(0, 4), mine=rng.randint(0, 3), opponent=rng.randint(0, 3),
+                    mana=rng.randint(0, 12), opponent_hp=30)
+    state = load_agent(bot, text).state
+    legal = end_positions(bot, state, lambda state: state.generateActions())
+    canonical = end_positions(bot, state, lambda state: state.canonical_actions())
+    if canonical == legal: return None
+    return "{} end positions, {} missed and {} more by the canonical actions".format(
+        len(legal), len(legal - canonical), len(canonical - legal)), text
+
+
+def check_lethal(bot, cards, rng):
+    # my board keeps two free slots: the solver does not trade a creature away to summon a charge creature
+    text = position(cards, rng, hand=rng.randint(0, 6), mine=rng.randint(0, 4), opponent=rng.randint(0, 4),
+                    mana=rng.randint(1, 12), opponent_hp=rng.randint(1, 14))
+    state = load_agent(bot, text).state
+    seen = set()
+
+    def kills():
+        if state.hp(1) <= 0: return True
+        if state.hash in seen: return False
+        seen.add(state.hash)
+        for action in list(state.generateActions()):
+            state.update_action(action)
+            killed = kills()
+            state.undo()
+            if killed: return True
+        return False
+
+    lethal = kills()
+    actions = bot.LethalSolver(state, time.perf_counter_ns() + NO_DEADLINE_NS).solve()
+    if actions is None:
+        return ("the legal actions kill, the solver found nothing", text) if lethal else None
+    replay = state.clone()
+    for action in actions:
+        if action not in replay.generateActions(): return "the solver's turn plays an illegal action", text
+        replay.update_action(action)
+    if replay.hp(1) > 0: return "the solver's turn leaves the opponent {} hp".format(replay.hp(1)), text
+    return None
+
+
+def check_combat(bot, cards, rng):
+    # no card in hand: the planner plans the attacks only, every legal action is one
+    text = position(cards, rng, hand=0, mine=rng.randint(0, 4), opponent=rng.randint(0, 4), mana=1,
+                    opponent_hp=rng.randint(1, 30))
+    agent = load_agent(bot, text)
+    state = agent.state
+    seen = set()
+
+    def best_score():
+        if state.hash in seen: return -float('inf')
+        seen.add(state.hash)
+        best = agent.eval_score(state)
+        for action in list(state.generateActions()):
+            state.update_action(action)
+            best = max(best, best_score())
+            state.undo()
+        return best
+
+    best = best_score()
+    replay = state.clone()
+    for action in agent.plan_attacks(replay, deadline_ns=time.perf_counter_ns() + NO_DEADLINE_NS):
+        if action not in replay.generateActions(): return "the planner plays an illegal attack", text
+        replay.update_action(action)
+    score = agent.eval_score(replay)
+    if score < best - 1e-9: return "the planned attacks score {}, the best attacks {}".format(score, best), text
+    return None
+
+
+CHECKS = {
+    'canonical': check_canonical,
+    'lethal': check_lethal,
+    'combat': check_combat,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the search shortcuts of a bot against brute force")
+    parser.add_argument('checks', nargs='*', help="the checks to run, all by default: " + ', '.join(sorted(CHECKS)))
+    parser.add_argument('--bot', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'))
+    parser.add_argument('--positions', type=int, default=POSITIONS)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    unknown = sorted(set(args.checks) - set(CHECKS))
+    if unknown: parser.error("unknown checks: " + ', '.join(unknown))
+
+    bot = load_bot(args.bot)
+    cards = referee.generate_cards()
+    failed = False
+    for name in args.checks or sorted(CHECKS):
+        rng = random.Random(args.seed)
+        start = time.perf_counter()
+        failures = 0
+        for k in range(args.positions):
+            failure = CHECKS[name](bot, cards, rng)
+            if failure is None: continue
+            failures += 1
+            message, text = failure
+            print("{} position {}: {}\n{}".format(name, k, message, text))
+        print("{:<10} {} positions, {} failed in {:.1f}s".format(name, args.positions, failures,
+                                                                 time.perf_counter() - start))
+        failed = failed or failures > 0
+    sys.stdin = sys.__stdin__
+    if failed: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import sys
+import time
 from enum import Enum
 
 """ for debugging """
@@ -23,6 +24,25 @@ BlueItem = 3
 
 MAX_MANA = 12
 
+OPPONENT_FACE = -1
+
+""" Keywords, bit i of the mask is the i-th letter of the abilities string 'BCDGLW' """
+KW_BREAKTHROUGH = 1
+KW_CHARGE = 2
+KW_DRAIN = 4
+KW_GUARD = 8
+KW_LETHAL = 16
+KW_WARD = 32
+
+ABILITY_LETTERS = 'BCDGLW'
+
+""" Attack assignment of CombatPlanner """
+COMBAT_HP_WEIGHT = 1.0
+COMBAT_STAT_WEIGHT = 1.0
+COMBAT_KILL_BONUS = 2.0
+COMBAT_DRAIN_WEIGHT = 0.5
+COMBAT_BUDGET_NS = 3_000_000  # time a plan may take before the planner falls back to the greedy one
+
 LOW = 3
 MEDIUM = 6
 
@@ -34,6 +54,10 @@ FOUR = 7
 FIVE = 5
 SIX = 4
 SEVEN_PLUS = 3
+CURVE_TARGETS = (ZERO, ONE, TWO, THREE, FOUR, FIVE, SIX, SEVEN_PLUS)  # picks by cost, the last one is 7+
+CREATURE_NUM = 27
+CREATURE_WEIGHT = 6  # weight of the distance to CREATURE_NUM against the curve's
+DRAFT_PICKS = 30
 
 CARDS_PER_DRAFT = 3
 
@@ -51,6 +75,7 @@ class Card:
         self.hpChangeEnemy = None
         self.cardDraw = None
         self.abilities = None
+        self.keywords = 0  # abilities as a mask of KW_* bits
         self.breakthrough = False
         self.charge = False
         self.guard = False
@@ -74,6 +99,24 @@ class Player:
         self.draw = None
 
 
+class PrintedCards:
+    """
+    Parse cache of the fields that never change, by cardId: (cardType, cost, hpChange, hpChangeEnemy, cardDraw).
+    A card in hand, where the draft offers are too, shows its printed values: it is kept the first time it is
+    seen there, and these fields of its later lines are not parsed again. Nothing is derived from them.
+    """
+
+    def __init__(self):
+        self.cards = {}
+
+    def get(self, card_id):
+        return self.cards.get(card_id)
+
+    def add(self, card):
+        if card.location != InHand or card.cardId in self.cards: return
+        self.cards[card.cardId] = (card.cardType, card.cost, card.hpChange, card.hpChangeEnemy, card.cardDraw)
+
+
 class State:
     def __init__(self):
         self.players = [Player(), Player()]
@@ -172,41 +215,265 @@ class Turn:
 
 
 class ManaCurve:
-    def __init__(self):
-        self.curve = None
-        self.creature_count = None
-
-    def compute_curve(self, cards):
-        self.curve = [0 for _ in range(MAX_MANA + 1)]
+    """
+    Running histogram of the picks by cost bucket (the last bucket is 7+) and their number of creatures,
+    updated once per pick with add(). The distance to the target curve is kept along, so delta() scores
+    a candidate in O(1).
+    """
+
+    def __init__(self, targets=CURVE_TARGETS, creature_target=CREATURE_NUM, creature_weight=CREATURE_WEIGHT):
+        self.targets = targets
+        self.creature_target = creature_target
+        self.creature_weight = creature_weight
+        self.curve = [0] * len(targets)
         self.creature_count = 0
-        for card in cards:
-            self.curve[card.cost] += 1
-            if card.cardType == Creature:
-                self.creature_count += 1
+        self.score = sum(targets) + creature_weight * creature_target  # distance of the empty curve
 
-    def evaluate_score(self):
+    def delta(self, cost, creature):
         """
-        Calculate the total score of the drafted cards depending on its mana cost
+        Change of evaluate_score() if a card of this cost was added
         """
-        seven_plus = 0
-        for i in range(7, MAX_MANA+1):
-            seven_plus += self.curve[i]
+        bucket = min(cost, len(self.targets) - 1)
+        count = self.curve[bucket]
+        target = self.targets[bucket]
+        delta = abs(count + 1 - target) - abs(count - target)
+        if creature:
+            delta += self.creature_weight * (abs(self.creature_count + 1 - self.creature_target) -
+                                             abs(self.creature_count - self.creature_target))
+        return delta
+
+    def add(self, cost, creature):
+        self.score += self.delta(cost, creature)
+        self.curve[min(cost, len(self.targets) - 1)] += 1
+        if creature: self.creature_count += 1
 
-        return abs(self.curve[0] - ZERO) + abs(self.curve[1] - ONE) + abs(self.curve[2] - TWO) + abs(self.curve[3] - THREE) + abs(self.curve[4] - FOUR) + abs(self.curve[5] - FIVE) + abs(self.curve[6] - SIX) + abs(seven_plus - SEVEN_PLUS) + 6 * abs(self.creature_count - 27)
+    def evaluate_score(self):
+        """
+        Distance of the picks to the target curve and number of creatures, lower is better
+        """
+        return self.score
 
     def print(self):
         log(self.curve)
 
 
+def score_by_curve(engine, card):
+    """
+    How much closer to the target curve the picks get with the card
+    """
+    return -engine.curve.delta(card.cost, card.cardType == Creature)
+
+
+# The scorer of each pick: (number of picks it is used before, scorer)
+DRAFT_SCORERS = ((DRAFT_PICKS, score_by_curve),)
+
+
+class DraftEngine:
+    """
+    Draft: the cards offered are scored by the scorer of the pick (see DRAFT_SCORERS), higher is better,
+    and the first best one is picked and added to the mana curve.
+    A scorer is a function (engine, card) -> score, it can use the curve and the picks so far.
+    """
+
+    def __init__(self, scorers=None):
+        self.scorers = scorers if scorers is not None else DRAFT_SCORERS
+        self.curve = ManaCurve()
+        self.picks = []
+
+    def scorer(self):
+        for picks, scorer in self.scorers:
+            if len(self.picks) < picks: return scorer
+        return self.scorers[-1][1]
+
+    def pick(self, cards):
+        """
+        Index of the card picked among the offer
+        """
+        scorer = self.scorer()
+        best_pick = 0
+        best_score = -float('inf')
+        for i, card in enumerate(cards):
+            score = scorer(self, card)
+            if score > best_score:
+                best_pick = i
+                best_score = score
+        self.add(cards[best_pick])
+        return best_pick
+
+    def add(self, card):
+        self.picks.append(card)
+        self.curve.add(card.cost, card.cardType == Creature)
+
+
+# Copy of CombatPlanner in main.py, a bot is submitted as a single file: change it there and copy it over
+class CombatPlanner:
+    """
+    Attack assignment of the turn: each attacker hits a defender, the face or nothing, for the most value.
+    The attackers and defenders are (key, attack, defense, keywords), the attacks (attacker key, defender key or
+    OPPONENT_FACE) in the order they are made. Past deadline_ns (perf_counter_ns) the plan is the greedy one.
+    """
+
+    def __init__(self, attackers, defenders, deadline_ns=None):
+        self.attackers = attackers
+        self.defenders = sorted(defenders, key=lambda defender: not defender[3] & KW_GUARD)
+        self.guards = sum(1 for defender in defenders if defender[3] & KW_GUARD)
+        self.deadline_ns = deadline_ns if deadline_ns is not None else time.perf_counter_ns() + COMBAT_BUDGET_NS
+        self.elapsed = False  # the last plan ran out of time
+
+    def best_attacks(self, opponent_hp, hp_weight=COMBAT_HP_WEIGHT, stat_weight=COMBAT_STAT_WEIGHT,
+                     kill_bonus=COMBAT_KILL_BONUS, drain_weight=COMBAT_DRAIN_WEIGHT):
+        """
+        The attacks killing the opponent if there are some, the attacks of most value otherwise
+        """
+        # No more damage reaches the face than the attackers have, breakthrough included
+        if sum(attacker[1] for attacker in self.attackers if attacker[1] > 0) >= opponent_hp:
+            damage, attacks = self.plan(1.0, 0.0, 0.0, 0.0)
+            if damage >= opponent_hp: return list(attacks)
+        return list(self.plan(hp_weight, stat_weight, kill_bonus, drain_weight)[1])
+
+    @staticmethod
+    def hit(attacker, defender, defense, ward, hp_weight, stat_weight, kill_bonus, drain_weight):
+        """
+        (value, defense left) of a hit of the attacker on the defender with defense and ward left: the weights
+        are per point of damage to the face, of stats taken minus stats lost and of hp drained, and per kill
+        """
+        _, attack, attacker_defense, keywords = attacker
+        _, defender_attack, _, defender_keywords = defender
+        gain = 0.0
+        new_defense = defense
+        if not ward:
+            if keywords & KW_LETHAL or attack >= defense:
+                new_defense = 0
+                gain += stat_weight * (defender_attack + defense) + kill_bonus
+            else:
+                new_defense = defense - attack
+                gain += stat_weight * attack
+            if keywords & KW_BREAKTHROUGH and attack > defense: gain += hp_weight * (attack - defense)
+            if keywords & KW_DRAIN: gain += drain_weight * attack
+        if defender_attack > 0 and not keywords & KW_WARD:
+            if defender_keywords & KW_LETHAL or defender_attack >= attacker_defense:
+                gain -= stat_weight * (attack + attacker_defense) + kill_bonus
+            else:
+                gain -= stat_weight * defender_attack
+        return gain, new_defense
+
+    def plan(self, hp_weight, stat_weight, kill_bonus, drain_weight):
+        """
+        (value, attacks) of the most valuable attacks, of the greedy ones past the deadline
+        """
+        weights = (hp_weight, stat_weight, kill_bonus, drain_weight)
+        memo = {}
+        self.elapsed = False
+        if not self.defenders:
+            result = self.search(weights, memo, 0, (1 << len(self.attackers)) - 1, 0, False, True)
+        else:
+            _, _, defense, keywords = self.defenders[0]
+            result = self.search(weights, memo, 0, (1 << len(self.attackers)) - 1, defense,
+                                 bool(keywords & KW_WARD), True)
+        if self.elapsed: return self.greedy(*weights)
+        return result
+
+    def search(self, weights, memo, j, left, defense, ward, clear):
+        """
+        (value, attacks) of the attackers in the bitmask left from the defender j on, with the defense and ward
+        it has left, clear if every guard before it died. Hits on different defenders commute: they are taken
+        one after the other, guards first, each hit by every ordered sequence of the attackers left.
+        """
+        key = (j, left, defense, ward, clear)
+        result = memo.get(key)
+        if result is not None: return result
+        # The clock is read once per 32 positions
+        if self.elapsed or not len(memo) & 31 and time.perf_counter_ns() >= self.deadline_ns:
+            self.elapsed = True
+            return 0.0, ()
+
+        attackers = self.attackers
+        defenders = self.defenders
+        guards = self.guards
+        if j == guards and not clear:
+            result = (0.0, ())  # a guard lives: nothing else can be hit
+        elif j == len(defenders):
+            hp_weight, _, _, drain_weight = weights
+            value = 0.0
+            attacks = ()
+            for i in range(len(attackers)):
+                attacker_key, attack, _, keywords = attackers[i]
+                if not left >> i & 1 or attack <= 0: continue
+                value += hp_weight * attack + (drain_weight * attack if keywords & KW_DRAIN else 0.0)
+                attacks += ((attacker_key, OPPONENT_FACE),)
+            result = (value, attacks)
+        else:
+            # Done with the defender j
+            following = j + 1
+            next_clear = clear and (defense <= 0 or j >= guards)
+            if following < len(defenders):
+                _, _, next_defense, next_keywords = defenders[following]
+                result = self.search(weights, memo, following, left, next_defense, bool(next_keywords & KW_WARD),
+                                     next_clear)
+            else:
+                result = self.search(weights, memo, following, left, 0, False, next_clear)
+
+            # Or one more hit on it
+            defender = defenders[j]
+            for i in range(len(attackers) if defense > 0 else 0):
+                attacker = attackers[i]
+                if not left >> i & 1 or attacker[1] <= 0: continue
+                gain, new_defense = self.hit(attacker, defender, defense, ward, *weights)
+                value, attacks = self.search(weights, memo, j, left ^ 1 << i, new_defense, False, clear)
+                if value + gain > result[0]:
+                    result = (value + gain, ((attacker[0], defender[0]),) + attacks)
+
+        memo[key] = result
+        return result
+
+    def greedy(self, hp_weight, stat_weight, kill_bonus, drain_weight):
+        """
+        (value, attacks) of the defenders taken in the same order, each hit by the attacker whose hit is worth
+        the most over hitting the face, while that is more than nothing, a guard until it dies, then the
+        attackers left on the face. Nothing else is hit once a guard lives.
+        """
+        left = [attacker for attacker in self.attackers if attacker[1] > 0]
+        value = 0.0
+        attacks = []
+
+        def face(attacker):
+            _, attack, _, keywords = attacker
+            return hp_weight * attack + (drain_weight * attack if keywords & KW_DRAIN else 0.0)
+
+        for j, defender in enumerate(self.defenders):
+            defense = defender[2]
+            ward = bool(defender[3] & KW_WARD)
+            while defense > 0 and left:
+                best = None  # (gain over the face, gain, attacker, defense left)
+                for attacker in left:
+                    gain, new_defense = self.hit(attacker, defender, defense, ward,
+                                                 hp_weight, stat_weight, kill_bonus, drain_weight)
+                    over = gain if j < self.guards else gain - face(attacker)
+                    if best is None or over > best[0]: best = (over, gain, attacker, new_defense)
+                over, gain, attacker, defense = best
+                if j >= self.guards and over <= 0: break
+                value += gain
+                attacks.append((attacker[0], defender[0]))
+                left.remove(attacker)
+                ward = False
+            if j < self.guards and defense > 0: return value, tuple(attacks)
+
+        for attacker in left:
+            value += face(attacker)
+            attacks.append((attacker[0], OPPONENT_FACE))
+        return value, tuple(attacks)
+
+
 class Agent:
     def __init__(self):
         self.state = State()
         self.bestTurn = Turn()  # best turn actions found
-        self.drafted_cards = []
+        self.draft_engine = DraftEngine()
         self.my_creatures = []
         self.enemy_creatures = []
         self.enemy_guards = []
         self.enemy_non_guards = []
+        self.printed_cards = PrintedCards()
 
     def reset(self):
         self.my_creatures.clear()
@@ -228,20 +495,6 @@ class Agent:
         """
         self.bestTurn.print()
 
-    def findBestPair(self):
-        bestPairs = []
-        if len(self.enemy_guards) != 0: return bestPairs  # if guard-enemy exists
-        for enemy in self.enemy_non_guards:
-            if enemy.used: continue  # if enemy card already in plan
-            for my_card in self.my_creatures:
-                if my_card.used: continue  # if my card already in plan
-                if my_card.attack >= enemy.defense and my_card.defense > enemy.attack:
-                    bestPairs.append((my_card, enemy))
-                    my_card.used = True
-                    enemy.used = True
-                    break
-        return bestPairs
-
     def read(self):
         """
         Read all inputs
@@ -273,16 +526,20 @@ class Agent:
             card_number = int(inputs[0])
             instance_id = int(inputs[1])
             location = int(inputs[2])
-            card_type = int(inputs[3])
-            cost = int(inputs[4])
             attack = int(inputs[5])
             defense = int(inputs[6])
             abilities = inputs[
                 7]  # the abilities of a card. Each letter representing an ability (B for Breakthrough, C for Charge and G for Guard)
             # log("Abilities: {}".format(abilities))
-            my_health_change = int(inputs[8])
-            opponent_health_change = int(inputs[9])
-            card_draw = int(inputs[10])
+            static = self.printed_cards.get(card_number)
+            if static is None:
+                card_type = int(inputs[3])
+                cost = int(inputs[4])
+                my_health_change = int(inputs[8])
+                opponent_health_change = int(inputs[9])
+                card_draw = int(inputs[10])
+            else:
+                card_type, cost, my_health_change, opponent_health_change, card_draw = static
 
             card.cardId = card_number
             card.id = instance_id
@@ -301,36 +558,20 @@ class Agent:
                 if c == 'B': card.breakthrough = True
                 if c == 'C': card.charge = True
                 if c == 'G': card.guard = True
+            for bit, letter in enumerate(ABILITY_LETTERS):
+                if letter in abilities: card.keywords |= 1 << bit
 
+            self.printed_cards.add(card)
             self.state.cards.append(card)
 
     def think(self):
         """ The Core part """
 
         def draft():
-            curve = ManaCurve()
-            # compute the scores for the three choices
-            bestScore = float('inf')
-            bestPick = None
-            for i in range(CARDS_PER_DRAFT):
-                card = self.state.cards[i]
-                curve.compute_curve(self.drafted_cards)
-                curve.curve[card.cost] += 1
-                if card.cardType == Creature: curve.creature_count += 1
-
-                score = curve.evaluate_score()
-                curve.curve[card.cost] -= 1
-                if card.cardType == Creature: curve.creature_count -= 1
-
-                if score < bestScore:
-                    bestScore = score
-                    bestPick = i
-
             action = Action()
-            action.pick(id=bestPick)
+            action.pick(id=self.draft_engine.pick(self.state.cards[:CARDS_PER_DRAFT]))
             self.bestTurn.actions.append(action)
-            self.drafted_cards.append(self.state.cards[bestPick])
-            curve.print()
+            self.draft_engine.curve.print()
 
         def prepare():
             """
@@ -392,45 +633,11 @@ class Agent:
                     self.bestTurn.actions.append(action)
 
         def think_attack():
-            def hitFace():
-                for card in self.state.cards:
-                    if card.location != Mine: continue
-                    if card.used: continue
-                    if len(self.enemy_guards) == 0:
-                        self.attack(id=card.id)  # hit face
-                        card.used = True
-
-            def trade():
-                bestPairs = self.findBestPair()
-                if len(bestPairs) != 0:
-                    for (my_card, enemy_card) in bestPairs:
-                        self.attack(my_card.id, enemy_card.id)
-
-            def attackGuard():
-                for card in self.state.cards:
-                    if len(self.enemy_guards) == 0: break
-                    if card.location != Mine: continue
-                    if card.used: continue
-                    guard = self.enemy_guards[0]
-                    self.attack(id=card.id, idTarget=guard.id)
-                    card.used = True
-                    guard.defense = guard.defense - card.attack
-                    if guard.defense <= 0:
-                        self.enemy_guards.remove(guard)
-
-            def can_win():
-                total_attack = 0
-                for mine in self.my_creatures:
-                    if mine.used: continue
-                    total_attack += mine.attack
-                return total_attack >= self.state.players[1].hp
-
-            attackGuard()
-            if can_win():
-                hitFace()
-            else:
-                trade()
-                hitFace()
+            attackers = [(card.id, card.attack, card.defense, card.keywords) for card in self.my_creatures
+                         if not card.used]
+            defenders = [(card.id, card.attack, card.defense, card.keywords) for card in self.enemy_creatures]
+            for id, idTarget in CombatPlanner(attackers, defenders).best_attacks(self.state.players[1].hp):
+                self.attack(id, idTarget)
 
         self.bestTurn.clear()
         if self.state.isInDraft():
@@ -1,20 +1,130 @@
 import sys
+import atexit
+from array import array
 from enum import Enum
-import copy
+import gc
+import itertools
+import json
+import math
+import multiprocessing
 import random
 import time
 
+try:
+    import numpy as np
+except ImportError:  # batch evaluation is skipped without NumPy
+    np = None
+
 """ for debugging """
 
+# Log levels: a message is kept when its level is <= LOG_LEVEL
+LOG_ERROR = 0
+LOG_INFO = 1
+LOG_DEBUG = 2
+LOG_TRACE = 3  # search hot path
+LOG_LEVEL = LOG_INFO
+
+# Hot path logging must be guarded by `if TRACE:` so nothing is even formatted when it is off
+TRACE = LOG_LEVEL >= LOG_TRACE
+
+# Per-turn search statistics (see SearchStats): None for none, "-" for one JSON line per turn on stderr,
+# otherwise the path of a file the lines are appended to. The hot path counters are guarded by `if STATS:`
+STATS_PATH = None
+STATS = STATS_PATH is not None
+
+_log_lines = []
+
+
+def log(msg, level=LOG_INFO):
+    """
+    Buffer a message for stderr, the turn's messages are written at once by flush_log()
+    """
+    if level <= LOG_LEVEL:
+        _log_lines.append(str(msg))
+
+
+def flush_log():
+    """
+    Write the buffered messages, once per turn after the output line
+    """
+    if _log_lines:
+        _log_lines.append('')
+        sys.stderr.write('\n'.join(_log_lines))
+        sys.stderr.flush()
+        _log_lines.clear()
+
 
-def log(msg):
-    print(msg, file=sys.stderr, flush=True)
+atexit.register(flush_log)
 
 
 def trap():
+    flush_log()
     exit(1)
 
 
+class SearchStats:
+    """
+    What the search did during a turn: complete turns played out (rollouts) and their length, legal actions
+    per decision, improvements of the best score, time in move generation, simulation and evaluation,
+    and State clones. write() emits them as one JSON line and starts the next turn.
+    """
+
+    def __init__(self):
+        self.out = None
+        self.reset()
+
+    def reset(self):
+        self.rollouts = 0
+        self.rollout_actions = 0
+        self.decisions = 0
+        self.legal_actions = 0
+        self.best = []  # [ms since the start of the turn, score] each time the best turn improved
+        self.generate_ns = 0
+        self.simulate_ns = 0
+        self.evaluate_ns = 0
+        self.evaluations = 0
+        self.tt_hits = 0
+        self.clones = 0
+        self.replies = 0  # final positions scored after the opponent's reply, see Agent.reply()
+        self.reply_cutoffs = 0  # final positions that could not beat the best turn, so got no reply
+
+    def rollout(self, actions):
+        self.rollouts += 1
+        self.rollout_actions += actions
+
+    def improved(self, timeout, score):
+        if math.isinf(score):
+            score = 'inf' if score > 0 else '-inf'  # JSON has no infinite numbers
+        else:
+            score = round(score, 3)
+        self.best.append([round(timeout.elapsed() * 1000, 2), score])
+
+    def write(self, turn, mode, timeout, actions):
+        record = {
+            'turn': turn, 'mode': mode, 'actions': actions,
+            'rollouts': self.rollouts,
+            'avg_depth': round(self.rollout_actions / self.rollouts, 2) if self.rollouts else 0,
+            'branching': round(self.legal_actions / self.decisions, 2) if self.decisions else 0,
+            'best': self.best,
+            'generate_ms': round(self.generate_ns / 1e6, 3),
+            'simulate_ms': round(self.simulate_ns / 1e6, 3),
+            'evaluate_ms': round(self.evaluate_ns / 1e6, 3),
+            'evaluations': self.evaluations, 'tt_hits': self.tt_hits, 'clones': self.clones,
+            'replies': self.replies, 'reply_cutoffs': self.reply_cutoffs,
+            'phases_ms': {phase: round(ns / 1e6, 3) for phase, ns in timeout.phase_ns.items()},
+        }
+        line = json.dumps(record, separators=(',', ':'))
+        if STATS_PATH == '-':
+            log(line, LOG_ERROR)
+        else:
+            if self.out is None: self.out = open(STATS_PATH, 'a', buffering=1)
+            self.out.write(line + '\n')
+        self.reset()
+
+
+_stats = SearchStats()
+
+
 class Random(object):
     """
         def __init__(self, x=time):
@@ -36,21 +146,82 @@ class Random(object):
 
 
 class Timeout:
-    def __init__(self):
-        self.start_time = None
+    """
+    Turn clock on perf_counter_ns. The budget of the turn is set by start(), the first draft turn and the first
+    battle turn get their own.
+    The search loops call tick() every iteration, which only reads the clock every `interval` iterations,
+    the interval following the measured cost of an iteration so the clock is read about every TIMEOUT_CHECK_NS.
+    mark() charges the time since the previous mark to a phase of the turn (see PHASES).
+    """
 
-    def start(self):
-        self.start_time = time.time()
+    def __init__(self):
+        self.turns = 0
+        self.battle_turns = 0
+        self.start_ns = 0
+        self.deadline_ns = 0
+        self.interval = 1  # iterations between two clock reads
+        self.countdown = 1
+        self.last_check_ns = 0
+        self.last_mark_ns = 0
+        self.phase_ns = dict.fromkeys(PHASES, 0)
+
+    def start(self, draft=False):
+        self.start_ns = time.perf_counter_ns()
+        first = self.turns == 0 if draft else self.battle_turns == 0
+        budget = FIRST_TURN_BUDGET_SECONDS if first else TURN_BUDGET_SECONDS
+        self.deadline_ns = self.start_ns + int(budget * 1e9)
+        self.turns += 1
+        if not draft: self.battle_turns += 1
+        self.interval = 1
+        self.countdown = 1
+        self.last_check_ns = self.start_ns
+        self.last_mark_ns = self.start_ns
+        for phase in self.phase_ns: self.phase_ns[phase] = 0
+
+    def is_elapsed(self):
+        """
+        Read the clock now
+        """
+        return time.perf_counter_ns() >= self.deadline_ns
 
-    def is_elapsed(self, max_span_seconds):
+    def tick(self):
         """
-        max_span: (seconds)
+        Amortised is_elapsed() for the search loops, call it once per iteration
         """
-        time_span = time.time()
-        if time_span - self.start_time > max_span_seconds:
-            return True
+        self.countdown -= 1
+        if self.countdown > 0: return False
+        now = time.perf_counter_ns()
+        if now >= self.deadline_ns: return True
+        per_iteration = max(1, (now - self.last_check_ns) // self.interval)
+        # the interval at most doubles so one slow iteration after fast ones cannot push it too far
+        self.interval = max(1, min(self.interval * 2, TIMEOUT_CHECK_NS // per_iteration))
+        self.countdown = self.interval
+        self.last_check_ns = now
         return False
 
+    def remaining(self):
+        """
+        Seconds left in the turn's budget, never negative
+        """
+        return max(0, self.deadline_ns - time.perf_counter_ns()) / 1e9
+
+    def elapsed(self):
+        """
+        Seconds since the turn started
+        """
+        return (time.perf_counter_ns() - self.start_ns) / 1e9
+
+    def mark(self, phase):
+        """
+        Charge the time since the previous mark (or the start of the turn) to phase
+        """
+        now = time.perf_counter_ns()
+        self.phase_ns[phase] += now - self.last_mark_ns
+        self.last_mark_ns = now
+
+    def phase_summary(self):
+        return ' '.join('{}: {:.2f}ms'.format(phase, self.phase_ns[phase] / 1e6) for phase in PHASES)
+
 
 """ Card locations """
 Opponent = -1  # on the opponent's side of the board
@@ -72,7 +243,183 @@ MAX_CREATURES_IN_PLAY = 6
 
 OPPONENT_FACE = -1
 
-MAX_SPAN_SECONDS = 0.10
+""" Time """
+# The referee allows 1000ms for the first draft answer and the first battle answer and 100ms for the others,
+# counted on its side. The budgets leave room for the output, the pipes and the searches' overshoot: at 90ms the
+# answers reached 95-100ms in self-play.
+FIRST_TURN_BUDGET_SECONDS = 0.90
+TURN_BUDGET_SECONDS = 0.080
+TIMEOUT_CHECK_NS = 500_000  # Timeout.tick() reads the clock about this often
+
+# Phases of a turn timed by Timeout.mark()
+PHASE_PARSE = "parse"
+PHASE_DRAFT = "draft"
+PHASE_LETHAL = "lethal"
+PHASE_SEARCH = "search"
+PHASE_OUTPUT = "output"
+PHASES = (PHASE_PARSE, PHASE_DRAFT, PHASE_LETHAL, PHASE_SEARCH, PHASE_OUTPUT)
+
+""" Search """
+SEARCH_RANDOM = "random"  # flat random rollouts
+SEARCH_MCTS = "mcts"  # UCT tree over the action sequence of the turn
+SEARCH_BEAM = "beam"  # deterministic beam search over the action sequence of the turn
+SEARCH_MODE = SEARCH_RANDOM
+
+MCTS_EXPLORATION = 0.7  # UCT exploration constant, rewards are in [0, 1]
+MCTS_SCORE_SCALE = 4.0  # eval_score gain over the root that moves the reward from 0.5 to ~0.73
+
+BEAM_MAX_WIDTH = 64  # partial turns kept after each step when time allows
+
+# Two-ply: the turns are compared after the opponent's best attacks with its board, see Agent.reply()
+TWO_PLY = True
+REPLY_PLAN_NS = 2_000_000  # time the CombatPlanner may take for a reply before it plans greedily
+REPLY_RESERVE_NS = 5_000_000  # no reply is started this close to the deadline, a reply takes REPLY_PLAN_NS and more
+
+# Lethal check before the search, see LethalSolver
+LETHAL_SOLVER = True
+LETHAL_MAX_PLANS = 4096  # combinations of cards and targets tried before giving up on a position
+LETHAL_BUDGET_NS = 1_000_000  # time the solver may take before the search runs without it
+
+# Attack assignment of CombatPlanner, searched first by the searches, the weights follow eval_score
+COMBAT_ORDERING = True
+COMBAT_HP_WEIGHT = 1.0
+COMBAT_STAT_WEIGHT = 0.1
+COMBAT_KILL_BONUS = 0.0
+COMBAT_DRAIN_WEIGHT = 1.0
+COMBAT_BUDGET_NS = 3_000_000  # time a plan may take before the planner falls back to the greedy one
+
+# Rollout policy, a softmax draw on ROLLOUT_PRIORITY (see action_priority()), see Agent.getRandomAction()
+ROLLOUT_EPSILON = 1.0  # share of the rollout steps drawn uniformly, the softmax did not beat 1.0 in self-play
+ROLLOUT_TEMPERATURE = 2.0  # a priority higher by this much makes an action e times as likely
+ROLLOUT_CARD_PRIORITY = 100  # cards come before the attacks, so the charge creatures and the removal count
+
+# Root parallelism of the random and MCTS searches, see Agent.parallel_think()
+PARALLEL_WORKERS = 0  # worker processes searching the position along with the bot's own, 0 for none
+PARALLEL_MERGE_NS = 3_000_000  # the searches stop this long before the deadline, to collect and merge the results
+
+""" Keywords, bit i of the mask is the i-th letter of the abilities string 'BCDGLW' """
+KW_BREAKTHROUGH = 1
+KW_CHARGE = 2
+KW_DRAIN = 4
+KW_GUARD = 8
+KW_LETHAL = 16
+KW_WARD = 32
+
+ABILITY_LETTERS = b'BCDGLW'
+
+
+def ability_masks():
+    """
+    Lookup table from every abilities string of the input ('B-D---', ...) to its keyword mask
+    """
+    masks = {}
+    for mask in range(1 << len(ABILITY_LETTERS)):
+        abilities = bytes(letter if mask >> bit & 1 else ord('-') for bit, letter in enumerate(ABILITY_LETTERS))
+        masks[abilities] = mask
+    return masks
+
+
+ABILITY_MASKS = ability_masks()
+
+
+def abilities_mask(abilities):
+    """
+    Keyword mask of an abilities string, reading the letters wherever they are if it is not in the usual layout
+    """
+    mask = ABILITY_MASKS.get(abilities)
+    if mask is None:
+        mask = 0
+        for bit, letter in enumerate(ABILITY_LETTERS):
+            if letter in abilities: mask |= 1 << bit
+    return mask
+
+""" Card line of the input: one field per column """
+IN_CARD_NUMBER = 0
+IN_ID = 1
+IN_LOCATION = 2
+IN_TYPE = 3
+IN_COST = 4
+IN_ATTACK = 5
+IN_DEFENSE = 6
+IN_ABILITIES = 7
+IN_HP_CHANGE = 8
+IN_HP_CHANGE_ENEMY = 9
+IN_CARD_DRAW = 10
+INPUT_CARD_FIELDS = 11
+
+# Fields of the card line that never change, by the CardDatabase table holding them
+STATIC_FIELDS = {IN_TYPE: 'types', IN_COST: 'costs', IN_HP_CHANGE: 'hp_changes',
+                 IN_HP_CHANGE_ENEMY: 'hp_changes_enemy', IN_CARD_DRAW: 'card_draws'}
+
+INPUT_CHUNK_SIZE = 1 << 16
+
+""" Compact state layout """
+# Player block: PLAYER_FIELDS values for each player at the start of the buffer
+P_HP = 0
+P_MANA = 1
+P_CARDS_DRAWN = 2
+PLAYER_FIELDS = 3
+
+# Card masks: bit idx is set while the card idx belongs to the set
+MY_BOARD = 2 * PLAYER_FIELDS  # my creatures on the board
+OPPONENT_BOARD = MY_BOARD + 1  # opponent creatures on the board, the attack and red item targets
+HAND = OPPONENT_BOARD + 1  # cards in my hand
+READY = HAND + 1  # my creatures that can still attack
+GUARDS = READY + 1  # opponent creatures with Guard
+OPPONENT_READY = GUARDS + 1  # opponent creatures that can attack, in its turn
+MY_GUARDS = OPPONENT_READY + 1  # my creatures with Guard
+
+# Last simulated action (packed, -1 at the start of the turn) and whether it changed what the other actions can do
+LAST_ACTION = MY_GUARDS + 1
+LAST_INTERACTS = LAST_ACTION + 1
+HEADER_SIZE = LAST_INTERACTS + 1
+
+# The masks and the board location of each side, by player_idx
+BOARD_MASKS = (MY_BOARD, OPPONENT_BOARD)
+READY_MASKS = (READY, OPPONENT_READY)
+GUARD_MASKS = (MY_GUARDS, GUARDS)
+SIDE_LOCATIONS = (Mine, Opponent)
+
+# Card columns: one value per card, column after column, following the header
+COL_LOCATION = 0
+COL_ATTACK = 1
+COL_DEFENSE = 2
+COL_COST = 3
+COL_KEYWORDS = 4
+COL_CAN_ATTACK = 5
+CARD_FIELDS = 6
+
+""" Zobrist hashing of the buffer """
+ZOBRIST_SEED = 20190612
+ZOBRIST_VALUE_BITS = 7  # values are hashed modulo 128
+ZOBRIST_VALUE_MASK = (1 << ZOBRIST_VALUE_BITS) - 1
+ZOBRIST_PLAYER_FIELDS = (P_HP, P_MANA)
+ZOBRIST_CARD_COLUMNS = (COL_LOCATION, COL_ATTACK, COL_DEFENSE, COL_KEYWORDS, COL_CAN_ATTACK)
+
+TT_CAPACITY = 1 << 16  # positions kept by a TranspositionTable
+
+""" Evaluation """
+EVAL_BATCH_SIZE = 64  # leaves scored together by a BatchEvaluator, 1 scores every leaf on its own
+
+""" Canonical move ordering, see State.is_pruned() """
+CANONICAL_ORDERING = True
+PRUNING_RETRIES = 1  # random draws rejected before listing the canonical actions
+
+""" Packed actions: type << 13 | idx << 7 | (idxTarget + 1), so they sort by (type, idx, idxTarget) """
+A_SUMMON = 1
+A_ATTACK = 2
+A_USE = 3
+A_PICK = 4
+
+ACTION_TYPE_SHIFT = 13
+ACTION_IDX_SHIFT = 7
+ACTION_IDX_MASK = 63
+ACTION_TARGET_MASK = 127
+
+
+def pack_action(action_type, idx=0, idxTarget=OPPONENT_FACE):
+    return action_type << ACTION_TYPE_SHIFT | idx << ACTION_IDX_SHIFT | (idxTarget + 1)
+
 
 """ Mana curve """
 ZERO = 1
@@ -83,10 +430,28 @@ FOUR = 7
 FIVE = 4
 SIX = 2
 SEVEN_PLUS = 2
+CURVE_TARGETS = (ZERO, ONE, TWO, THREE, FOUR, FIVE, SIX, SEVEN_PLUS)  # picks by cost, the last one is 7+
 CREATURE_NUM = 25
+CREATURE_WEIGHT = 10  # weight of the distance to CREATURE_NUM against the curve's
+DRAFT_PICKS = 30
+
+""" Draft lookahead, see DraftLookahead """
+LOOKAHEAD_SAMPLES = 2000  # completions of the draft sampled at each pick
+LOOKAHEAD_MIN_POOL = 12  # distinct cards seen before the pool is sampled
+CARD_VALUE_PICKS = 21  # until the pool is sampled, or without NumPy: picks by card value, then by curve
+LOOKAHEAD_VALUE_WEIGHT = 2.0  # weight of the creatures' value against the distance to the curve in a deck's quality
+
+""" Card database """
+CARD_COUNT = 160  # cardIds of the LOCM card list are 1 to 160
+KEYWORD_VALUES = ((KW_WARD, 1.5), (KW_DRAIN, 1.05), (KW_LETHAL, 1.3), (KW_GUARD, 1.15))  # bonus of a creature
 
 
 class Card:
+    """
+    A card as read from the input, built by State.card() for the draft and debugging.
+    The simulation works on the State buffer and columns instead.
+    """
+
     def __init__(self):
         self.id = None  # the identifier of a card
         self.idx = None
@@ -99,7 +464,7 @@ class Card:
         self.hpChange = None
         self.hpChangeEnemy = None
         self.cardDraw = None
-        # self.abilities = None
+        self.keywords = 0  # bitmask of the KW_* flags
 
         self.breakthrough = False
         self.charge = False
@@ -111,9 +476,6 @@ class Card:
         self.canAttack = False
         self.used = False
 
-    def remove_ward(self):
-        self.ward = False
-
 
 class Player:
     def __init__(self):
@@ -123,257 +485,741 @@ class Player:
         self.rune = None
         self.draw = None
 
-        self.cards_drawn = 0  # Represented number of cards drawn with the turn
 
-    def do_attack(self, card, card_target):
-        if card.lethal:
-            self.receive_damage(card_target, amount=1000)
-        else:
-            self.receive_damage(card_target, amount=card.attack)
+def card_value(card_type, cost, attack, defense, keywords):
+    """
+    Static value of a card: its stats against twice its cost, plus the bonus of its keywords for a creature
+    """
+    if card_type == Creature:
+        value = attack + defense - cost * 2
+        for keyword, bonus in KEYWORD_VALUES:
+            if keywords & keyword: value += bonus
+        return value
+    return abs(attack) + abs(defense) + bin(keywords).count('1') - cost * 2
 
-    @classmethod
-    def receive_damage(cls, card, amount):
-        if amount <= 0: return
-        if card.ward:
-            card.remove_ward()
-            return
-        card.defense -= amount
-        if card.defense <= 0:
-            card.location = OutOfPlay
+
+class CardDatabase:
+    """
+    The printed attributes of the cards by cardId (keywords as a KW_* mask) and their card_value(), the one
+    feature computed per card, the draft reads it.
+    Both players draft from the same offers and a card in hand shows its printed values, so the table is filled
+    from the input: a card is added the first time it is seen there and looked up in O(1) afterwards.
+    A card on the board is not added, its attack, defense and keywords may have been changed.
+    """
+
+    def __init__(self, size=CARD_COUNT + 1):
+        self.known = [False] * size
+        self.types = [0] * size
+        self.costs = [0] * size
+        self.attacks = [0] * size
+        self.defenses = [0] * size
+        self.keywords = [0] * size
+        self.hp_changes = [0] * size
+        self.hp_changes_enemy = [0] * size
+        self.card_draws = [0] * size
+        self.values = [0.0] * size
+
+    def knows(self, card_numbers):
+        known = self.known
+        size = len(known)
+        for number in card_numbers:
+            if number >= size or not known[number]: return False
+        return True
+
+    def add(self, number, card_type, cost, attack, defense, keywords, hp_change, hp_change_enemy, card_draw):
+        if number >= len(self.known):
+            grow = number + 1 - len(self.known)
+            for table in self.__dict__.values():
+                table.extend([table[0]] * grow)
+        self.known[number] = True
+        self.types[number] = card_type
+        self.costs[number] = cost
+        self.attacks[number] = attack
+        self.defenses[number] = defense
+        self.keywords[number] = keywords
+        self.hp_changes[number] = hp_change
+        self.hp_changes_enemy[number] = hp_change_enemy
+        self.card_draws[number] = card_draw
+        self.values[number] = card_value(card_type, cost, attack, defense, keywords)
+
+    def learn(self, columns):
+        """
+        Add the cards in hand (the draft offers are in hand too) of the columns read this turn
+        """
+        for idx, number in enumerate(columns[IN_CARD_NUMBER]):
+            if columns[IN_LOCATION][idx] == InHand and not (number < len(self.known) and self.known[number]):
+                self.add(number, columns[IN_TYPE][idx], columns[IN_COST][idx], columns[IN_ATTACK][idx],
+                         columns[IN_DEFENSE][idx], columns[IN_ABILITIES][idx], columns[IN_HP_CHANGE][idx],
+                         columns[IN_HP_CHANGE_ENEMY][idx], columns[IN_CARD_DRAW][idx])
+
+
+_mask_idxs = {}
+
+
+def mask_to_idxs(mask):
+    """
+    Tuple of the card idxs whose bits are set in a mask, cached since the same masks come back all turn long
+    """
+    idxs = _mask_idxs.get(mask)
+    if idxs is None:
+        bits = []
+        rest = mask
+        while rest:
+            low = rest & -rest
+            bits.append(low.bit_length() - 1)
+            rest ^= low
+        idxs = _mask_idxs[mask] = tuple(bits)
+    return idxs
+
+
+_zobrist_tables = {}
+
+
+def zobrist_table(n):
+    """
+    Zobrist keys for a buffer of n cards, flat: key of (offset, value) at offset << ZOBRIST_VALUE_BITS | value.
+    The board masks, the draws and the costs are derived or constant during a turn and get zero keys.
+    """
+    table = _zobrist_tables.get(n)
+    if table is not None: return table
+
+    rnd = random.Random(ZOBRIST_SEED)
+    row_size = ZOBRIST_VALUE_MASK + 1
+    table = [0] * ((HEADER_SIZE + CARD_FIELDS * n) * row_size)
+    offsets = [i * PLAYER_FIELDS + field for i in range(2) for field in ZOBRIST_PLAYER_FIELDS]
+    offsets += [HEADER_SIZE + column * n + idx for column in ZOBRIST_CARD_COLUMNS for idx in range(n)]
+    for offset in offsets:
+        for value in range(row_size):
+            table[offset << ZOBRIST_VALUE_BITS | value] = rnd.getrandbits(64)
+
+    _zobrist_tables[n] = table
+    return table
+
+
+class TranspositionTable:
+    """
+    Bounded map from position hash to a value. Entries are kept in two generations: once the current one
+    holds capacity / 2 entries it replaces the previous one, which drops the oldest entries in O(1).
+    """
+
+    def __init__(self, capacity=TT_CAPACITY):
+        self.capacity = capacity // 2
+        self.current = {}
+        self.previous = {}
+
+    def get(self, key):
+        value = self.current.get(key)
+        if value is None:
+            value = self.previous.get(key)
+            if value is not None: self.put(key, value)  # still in use, keep it out of the next eviction
+        return value
+
+    def put(self, key, value):
+        if len(self.current) >= self.capacity:
+            self.previous = self.current
+            self.current = {}
+        self.current[key] = value
+
+    def clear(self):
+        self.current.clear()
+        self.previous.clear()
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
+class InputReader:
+    """
+    Reads the referee's input from the binary stdin. The referee writes a turn in one go, so each read
+    takes in everything available and the lines are handed out from that chunk.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.pos = 0
+        self.partial = b''  # start of a line not complete yet
+
+    def fill(self):
+        chunk = sys.stdin.buffer.read1(INPUT_CHUNK_SIZE)
+        if not chunk: raise EOFError("stdin closed")
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()
+        self.lines = self.lines[self.pos:] + lines
+        self.pos = 0
+
+    def line(self):
+        while self.pos >= len(self.lines):
+            self.fill()
+        self.pos += 1
+        return self.lines[self.pos - 1]
+
+    def read_lines(self, count):
+        while len(self.lines) - self.pos < count:
+            self.fill()
+        self.pos += count
+        return self.lines[self.pos - count:self.pos]
+
+
+# The State columns that do not change during a turn, in the order pack() writes them
+STATIC_COLUMNS = ('card_numbers', 'ids', 'types', 'hp_changes', 'hp_changes_enemy', 'card_draws')
 
 
 class State:
+    """
+    The simulated game. Everything an action can change lives in one flat array (see "Compact state layout"),
+    so clone() is a single buffer copy. The players and the static card columns keep the values read this
+    turn and are shared by the clones.
+    """
+
     def __init__(self):
         self.players = [Player(), Player()]
         self.opponent_hand = None
-        self.cards = []
         self.opponent_actions = None
         self.card_number_and_action_list = None
 
-        self.my_creatures_idxs = []
-        self.opponent_creatures_idxs = []
+        # static card columns, by card idx
+        self.card_numbers = []
+        self.ids = []
+        self.types = []
+        self.hp_changes = []
+        self.hp_changes_enemy = []
+        self.card_draws = []
+
+        self.data = array('q')
+        self.n = 0  # number of cards in the card columns
+
+        # undo records: (offset, previous value) pairs, and the trail length and hash before each action
+        self.trail = []
+        self.undo_marks = []
+        self.hash_marks = []
+
+        # Zobrist hash of the hp, mana and the card columns, kept up to date by set()
+        self.zobrist = zobrist_table(0)
+        self.hash = 0
+
+        # offsets of the card columns in self.data, set by set_layout()
+        self.o_location = HEADER_SIZE
+        self.o_attack = HEADER_SIZE
+        self.o_defense = HEADER_SIZE
+        self.o_cost = HEADER_SIZE
+        self.o_keywords = HEADER_SIZE
+        self.o_can_attack = HEADER_SIZE
 
         self.legal_actions = []
+        self.segments = []  # (number of actions, card idx) per playable card, filled by count_actions()
 
     def isInDraft(self):
         return self.players[0].mana == 0
 
+    def load(self, columns):
+        """
+        Pack the players and the card columns read this turn (indexed by IN_*) into the buffer
+        """
+        locations = columns[IN_LOCATION]
+        types = columns[IN_TYPE]
+        keywords = columns[IN_ABILITIES]
+        n = len(locations)
+        self.card_numbers = columns[IN_CARD_NUMBER]
+        self.ids = columns[IN_ID]
+        self.types = types
+        self.hp_changes = columns[IN_HP_CHANGE]
+        self.hp_changes_enemy = columns[IN_HP_CHANGE_ENEMY]
+        self.card_draws = columns[IN_CARD_DRAW]
+        self.set_layout(n)
+
+        data = array('q', [0]) * (HEADER_SIZE + CARD_FIELDS * n)
+        data[LAST_ACTION] = -1
+        for i in range(2):
+            player = self.players[i]
+            data[i * PLAYER_FIELDS + P_HP] = player.hp
+            data[i * PLAYER_FIELDS + P_MANA] = player.mana
+
+        data[self.o_location:self.o_location + n] = array('q', locations)
+        data[self.o_attack:self.o_attack + n] = array('q', columns[IN_ATTACK])
+        data[self.o_defense:self.o_defense + n] = array('q', columns[IN_DEFENSE])
+        data[self.o_cost:self.o_cost + n] = array('q', columns[IN_COST])
+        data[self.o_keywords:self.o_keywords + n] = array('q', keywords)
+
+        for idx in range(n):
+            location = locations[idx]
+            if location == InHand:
+                data[HAND] |= 1 << idx
+            elif types[idx] == Creature and location == Mine:
+                data[MY_BOARD] |= 1 << idx
+                data[READY] |= 1 << idx
+                data[self.o_can_attack + idx] = 1
+                if keywords[idx] & KW_GUARD: data[MY_GUARDS] |= 1 << idx
+            elif types[idx] == Creature and location == Opponent:
+                data[OPPONENT_BOARD] |= 1 << idx
+                data[OPPONENT_READY] |= 1 << idx
+                data[self.o_can_attack + idx] = 1
+                if keywords[idx] & KW_GUARD: data[GUARDS] |= 1 << idx
+
+        self.data = data
+        self.trail.clear()
+        self.undo_marks.clear()
+        self.hash_marks.clear()
+        self.rehash()
+
+    def set_layout(self, n):
+        """
+        Offsets of the card columns for n cards
+        """
+        self.n = n
+        self.o_location = HEADER_SIZE + COL_LOCATION * n
+        self.o_attack = HEADER_SIZE + COL_ATTACK * n
+        self.o_defense = HEADER_SIZE + COL_DEFENSE * n
+        self.o_cost = HEADER_SIZE + COL_COST * n
+        self.o_keywords = HEADER_SIZE + COL_KEYWORDS * n
+        self.o_can_attack = HEADER_SIZE + COL_CAN_ATTACK * n
+
+    def rehash(self):
+        """
+        Zobrist hash of the whole buffer, set() keeps it up to date afterwards
+        """
+        data = self.data
+        self.zobrist = zobrist_table(self.n)
+        self.hash = 0
+        for offset in range(len(data)):
+            self.hash ^= self.zobrist[offset << ZOBRIST_VALUE_BITS | data[offset] & ZOBRIST_VALUE_MASK]
+
+    def pack(self):
+        """
+        The position as bytes for the search workers: n, the static card columns, then the buffer
+        """
+        values = array('q', [self.n])
+        for column in STATIC_COLUMNS:
+            values.extend(getattr(self, column))
+        return values.tobytes() + self.data.tobytes()
+
+    @classmethod
+    def unpack(cls, blob):
+        """
+        The State packed by pack(), without the players and the opponent's last actions
+        """
+        values = array('q')
+        values.frombytes(blob)
+        n = values[0]
+        state = cls()
+        for i, column in enumerate(STATIC_COLUMNS):
+            setattr(state, column, values[1 + i * n:1 + (i + 1) * n].tolist())
+        state.set_layout(n)
+        state.data = values[1 + len(STATIC_COLUMNS) * n:]
+        state.rehash()
+        return state
+
+    def card(self, idx):
+        """
+        Card view of the card idx as it is in the buffer
+        """
+        data = self.data
+        card = Card()
+        card.idx = idx
+        card.id = self.ids[idx]
+        card.cardId = self.card_numbers[idx]
+        card.location = data[self.o_location + idx]
+        card.cardType = self.types[idx]
+        card.cost = data[self.o_cost + idx]
+        card.attack = data[self.o_attack + idx]
+        card.defense = data[self.o_defense + idx]
+        card.hpChange = self.hp_changes[idx]
+        card.hpChangeEnemy = self.hp_changes_enemy[idx]
+        card.cardDraw = self.card_draws[idx]
+        card.keywords = data[self.o_keywords + idx]
+        card.breakthrough = bool(card.keywords & KW_BREAKTHROUGH)
+        card.charge = bool(card.keywords & KW_CHARGE)
+        card.guard = bool(card.keywords & KW_GUARD)
+        card.drain = bool(card.keywords & KW_DRAIN)
+        card.ward = bool(card.keywords & KW_WARD)
+        card.lethal = bool(card.keywords & KW_LETHAL)
+        card.canAttack = bool(data[self.o_can_attack + idx])
+        return card
+
+    def clone(self):
+        """
+        Copy for simulation: the buffer is copied, the cards read this turn are shared
+        """
+        if STATS: _stats.clones += 1
+        state = State.__new__(State)
+        state.__dict__.update(self.__dict__)
+        state.data = self.data[:]
+        state.trail = []
+        state.undo_marks = []
+        state.hash_marks = []
+        state.legal_actions = []
+        state.segments = []
+        return state
+
+    def set(self, offset, value):
+        """
+        Write one value of the buffer, keeping the previous one for undo()
+        """
+        data = self.data
+        previous = data[offset]
+        self.trail.append(offset)
+        self.trail.append(previous)
+        zobrist = self.zobrist
+        row = offset << ZOBRIST_VALUE_BITS
+        self.hash ^= zobrist[row | previous & ZOBRIST_VALUE_MASK] ^ zobrist[row | value & ZOBRIST_VALUE_MASK]
+        data[offset] = value
+
+    def undo(self):
+        """
+        Take back the last update_action()
+        """
+        mark = self.undo_marks.pop()
+        self.hash = self.hash_marks.pop()
+        trail = self.trail
+        data = self.data
+        while len(trail) > mark:
+            value = trail.pop()
+            data[trail.pop()] = value
+
+    def undo_all(self):
+        """
+        Take back every update_action() since the last load()
+        """
+        if not self.undo_marks: return
+        self.undo_marks[1:] = []
+        self.hash_marks[1:] = []
+        self.undo()
+
+    @property
+    def my_creatures_idxs(self):
+        return list(mask_to_idxs(self.data[MY_BOARD]))
+
+    @property
+    def opponent_creatures_idxs(self):
+        return list(mask_to_idxs(self.data[OPPONENT_BOARD]))
+
+    def hp(self, player_idx):
+        return self.data[player_idx * PLAYER_FIELDS + P_HP]
+
+    def mana(self, player_idx):
+        return self.data[player_idx * PLAYER_FIELDS + P_MANA]
+
+    def count_actions(self):
+        """
+        Number of legal actions, action_at() draws one of them.
+        Only the playable cards in hand are looked at, the attacks are counted from the masks.
+        """
+        data = self.data
+        types = self.types
+        mana = data[P_MANA]
+        o_cost = self.o_cost
+        segments = self.segments
+        segments.clear()
+        count = 0
+
+        hand = data[HAND]
+        if hand:
+            my_creatures = bin(data[MY_BOARD]).count('1')
+            opponent_creatures = bin(data[OPPONENT_BOARD]).count('1')
+            for idx in mask_to_idxs(hand):
+                if data[o_cost + idx] > mana: continue
+                card_type = types[idx]
+                if card_type == Creature:
+                    size = 1 if my_creatures < MAX_CREATURES_IN_PLAY else 0
+                elif card_type == BlueItem:
+                    size = 1
+                elif card_type == RedItem:
+                    size = opponent_creatures
+                else:
+                    size = my_creatures
+                if size:
+                    segments.append((size, idx))
+                    count += size
+
+        ready = data[READY]
+        if ready:
+            guards = data[GUARDS]
+            targets = bin(guards).count('1') if guards else 1 + bin(data[OPPONENT_BOARD]).count('1')
+            size = bin(ready).count('1') * targets
+            segments.append((size, -1))
+            count += size
+
+        return count
+
+    def action_at(self, k):
+        """
+        The k-th legal action counted by the last count_actions()
+        """
+        data = self.data
+        for size, idx in self.segments:
+            if k >= size:
+                k -= size
+                continue
+
+            if idx == -1:
+                # Attacks: attacker k // targets on target k % targets, the face comes first when there is no guard
+                guards = data[GUARDS]
+                targets = mask_to_idxs(guards) if guards else (OPPONENT_FACE,) + mask_to_idxs(data[OPPONENT_BOARD])
+                attacker = mask_to_idxs(data[READY])[k // len(targets)]
+                return pack_action(A_ATTACK, attacker, targets[k % len(targets)])
+
+            card_type = self.types[idx]
+            if card_type == Creature:
+                return pack_action(A_SUMMON, idx)
+            elif card_type == BlueItem:
+                return pack_action(A_USE, idx, OPPONENT_FACE)
+            elif card_type == RedItem:
+                return pack_action(A_USE, idx, mask_to_idxs(data[OPPONENT_BOARD])[k])
+            else:
+                return pack_action(A_USE, idx, mask_to_idxs(data[MY_BOARD])[k])
+
+        return None
+
     def generateActions(self, player_idx=0):
         """
-        Generate a list of legal actions
+        Generate a list of legal actions (packed)
         """
 
         def debug_creatures_idxs():
             """
             For debugging only
             """
-            log("My Creatures:")
+            log("My Creatures:", LOG_DEBUG)
             for idx in self.my_creatures_idxs:
-                log(self.cards[idx].id)
+                log(self.ids[idx], LOG_DEBUG)
 
-            log("------")
-            log("Opponent Creatures:")
+            log("------", LOG_DEBUG)
+            log("Opponent Creatures:", LOG_DEBUG)
             for idx in self.opponent_creatures_idxs:
-                log(self.cards[idx].id)
-
-        my_player = self.players[0]
+                log(self.ids[idx], LOG_DEBUG)
 
-        self.legal_actions.clear()
+        data = self.data
+        actions = self.legal_actions
+        actions.clear()
 
         # debug_creatures_idxs()
 
-        for card in self.cards:
-            # Playing the cards in my hand
-            if card.location == InHand:
-                if card.cost <= my_player.mana:
-
-                    if card.cardType == Creature:  # Check if can summon
-                        if len(self.my_creatures_idxs) >= MAX_CREATURES_IN_PLAY: continue
-                        action = Action()
-                        action.summon(card.idx)
-                        self.legal_actions.append(action)
-
-                    else:
-                        # Blue item
-                        if card.cardType == BlueItem:
-                            action = Action()
-                            action.use(idx=card.idx, idxTarget=OPPONENT_FACE)
-                            self.legal_actions.append(action)
-
-                        elif card.cardType == RedItem:
-                            # Red item
-                            for creature_idx in self.opponent_creatures_idxs:
-                                # Red target opponent creature only
-                                if self.cards[creature_idx].location == Mine or self.cards[
-                                    creature_idx].location == InHand: continue
-                                action = Action()
-                                action.use(idx=card.idx, idxTarget=creature_idx)
-                                self.legal_actions.append(action)
-
-                        else:
-                            # Green item
-                            for creature_idx in self.my_creatures_idxs:
-                                # Green target my creature only
-                                if self.cards[creature_idx].location == Opponent or self.cards[
-                                    creature_idx].location == InHand: continue
-                                action = Action()
-                                action.use(idx=card.idx, idxTarget=creature_idx)
-                                self.legal_actions.append(action)
-
-            # Playing the cards on the board
-            elif card.location == Mine and card.canAttack:
-
-                # Find attacking target
-                found_guard = False
-                for creature_idx in self.opponent_creatures_idxs:
-                    creature = self.cards[creature_idx]
-                    if creature.location == Mine: continue
-                    if creature.guard:
-                        # Attack any of guards
-                        found_guard = True
-                        action = Action()
-                        action.attack(idx=card.idx, idxTarget=creature_idx)
-                        self.legal_actions.append(action)
-
-                if not found_guard:
-                    # Attack the player
-                    action_ = Action()
-                    action_.attack(idx=card.idx)
-                    self.legal_actions.append(action_)
-
-                    # Attack any of opponent creatures
-                    for creature_idx_ in self.opponent_creatures_idxs:
-                        action = Action()
-                        action.attack(idx=card.idx, idxTarget=creature_idx_)
-                        self.legal_actions.append(action)
-
-        for action in self.legal_actions:
-            log("CALCULATE: {} {} {}".format(action.type, self.cards[action.idx].id, self.cards[action.idxTarget].id))
+        # Same order as action_at(), one segment at a time
+        self.count_actions()
+        for size, idx in self.segments:
+            if idx == -1:
+                guards = data[GUARDS]
+                targets = mask_to_idxs(guards) if guards else (OPPONENT_FACE,) + mask_to_idxs(data[OPPONENT_BOARD])
+                for attacker in mask_to_idxs(data[READY]):
+                    base = A_ATTACK << ACTION_TYPE_SHIFT | attacker << ACTION_IDX_SHIFT
+                    for target in targets:
+                        actions.append(base | (target + 1))
+                continue
+
+            card_type = self.types[idx]
+            if card_type == Creature:
+                actions.append(pack_action(A_SUMMON, idx))
+            elif card_type == BlueItem:
+                actions.append(pack_action(A_USE, idx, OPPONENT_FACE))
+            else:
+                base = A_USE << ACTION_TYPE_SHIFT | idx << ACTION_IDX_SHIFT
+                for target in mask_to_idxs(data[OPPONENT_BOARD] if card_type == RedItem else data[MY_BOARD]):
+                    actions.append(base | (target + 1))
+
+        if TRACE:
+            for action in self.legal_actions:
+                log("CALCULATE: {} {} {}".format(action >> ACTION_TYPE_SHIFT,
+                                                 self.ids[action >> ACTION_IDX_SHIFT & ACTION_IDX_MASK],
+                                                 self.ids[(action & ACTION_TARGET_MASK) - 1]), LOG_TRACE)
         return self.legal_actions
 
-    @classmethod
-    def apply_global_effects(cls, player, opponent, card):
-        player.cards_drawn += card.cardDraw
-        player.mana -= card.cost
-        player.hp += card.hpChange
-        opponent.hp += card.hpChangeEnemy
-
-    def summon(self, my_player, opponent, player_idx, action):
-        if len(self.my_creatures_idxs) >= MAX_CREATURES_IN_PLAY: return
-        # Find the card summoned
-        card = self.cards[action.idx]
+    def is_pruned(self, action):
+        """
+        Canonical move ordering: whether the action is smaller than the last one and commutes with it, so the
+        other order is searched. They commute when they touch different cards and the last one did not interact.
+        """
+        data = self.data
+        last = data[LAST_ACTION]
+        if action >= last or data[LAST_INTERACTS]: return False
+
+        idx = action >> ACTION_IDX_SHIFT & ACTION_IDX_MASK
+        target = (action & ACTION_TARGET_MASK) - 1
+        last_idx = last >> ACTION_IDX_SHIFT & ACTION_IDX_MASK
+        last_target = (last & ACTION_TARGET_MASK) - 1
+        if idx == last_idx or idx == last_target: return False
+        if target != OPPONENT_FACE and (target == last_idx or target == last_target): return False
+        return True
+
+    def can_prune(self):
+        """
+        Whether is_pruned() can reject anything in this position
+        """
+        return self.data[LAST_ACTION] >= 0 and not self.data[LAST_INTERACTS]
+
+    def canonical_actions(self):
+        """
+        generateActions() without the actions pruned by the canonical move ordering.
+        A turn only ends when nothing is playable, so when every legal action is pruned they are all kept.
+        """
+        actions = self.generateActions()
+        if not self.can_prune(): return actions
+        is_pruned = self.is_pruned
+        canonical = [action for action in actions if not is_pruned(action)]
+        return canonical if canonical else actions
+
+    def apply_global_effects(self, player_idx, idx):
+        me = player_idx * PLAYER_FIELDS
+        opponent = (1 - player_idx) * PLAYER_FIELDS
+        data = self.data
+        if self.card_draws[idx]: self.set(me + P_CARDS_DRAWN, data[me + P_CARDS_DRAWN] + self.card_draws[idx])
+        self.set(me + P_MANA, data[me + P_MANA] - data[self.o_cost + idx])
+        if self.hp_changes[idx]: self.set(me + P_HP, data[me + P_HP] + self.hp_changes[idx])
+        if self.hp_changes_enemy[idx]:
+            self.set(opponent + P_HP, data[opponent + P_HP] + self.hp_changes_enemy[idx])
+
+    def remove_creature(self, idx):
+        data = self.data
+        bit = 1 << idx
+        self.set(self.o_location + idx, OutOfPlay)
+        side = 0 if data[MY_BOARD] & bit else 1
+        for mask in (BOARD_MASKS[side], READY_MASKS[side], GUARD_MASKS[side]):
+            if data[mask] & bit: self.set(mask, data[mask] & ~bit)
+
+    def receive_damage(self, idx, amount, lethal=False):
+        """
+        Deal damage to a creature, returns the damage actually dealt (0 when a ward absorbs it)
+        """
+        if amount <= 0: return 0
+        data = self.data
+        if data[self.o_keywords + idx] & KW_WARD:
+            self.set(self.o_keywords + idx, data[self.o_keywords + idx] & ~KW_WARD)
+            return 0
+        self.set(self.o_defense + idx, data[self.o_defense + idx] - amount)
+        if lethal or data[self.o_defense + idx] <= 0:
+            self.remove_creature(idx)
+        return amount
+
+    def summon(self, idx, player_idx=0):
+        data = self.data
+        board = BOARD_MASKS[player_idx]
+        if bin(data[board]).count('1') >= MAX_CREATURES_IN_PLAY: return
         # Validity check
-        assert card.cost <= my_player.mana, log("Attempted to summon a card without enough mana")
-        assert card.cardType == Creature, log('Attempted to summon a non-creature card')
+        assert data[self.o_cost + idx] <= data[player_idx * PLAYER_FIELDS + P_MANA], \
+            log("Attempted to summon a card without enough mana")
+        assert self.types[idx] == Creature, log('Attempted to summon a non-creature card')
         # Play the card onto the board
-        card.location = Mine
-        card.canAttack = card.charge  # Creature can attack once it has "Charge"
-        my_player.mana -= self.cards[action.idx].cost
-        self.my_creatures_idxs.append(card.idx)
-        self.apply_global_effects(card=card, player=my_player, opponent=opponent)
-
-    def attack(self, my_player, opponent, action, player_idx):
-        card = self.cards[action.idx]
-        assert card.location == Mine, log(
-            "Attacking with an attacker that I do not control")
-        if not card.canAttack: return
-
-        # Check for guards
-        found_guard = False
-        attacking_guard = False
-
-        for idxTarget in self.opponent_creatures_idxs:
-            creature = self.cards[idxTarget]
-            if creature.location == Mine: continue
-            if creature.guard:
-                if action.idxTarget == OPPONENT_FACE: log(
-                    "Attempting attacking a player when there is a guard on board")
-
-        assert not (found_guard and not attacking_guard), log(
-            "Attempting attacking a creature when there is a guard on board")
-
-        card.canAttack = False
-        if action.idxTarget == OPPONENT_FACE:  # Hit face
-            if card.attack > 0:
-                opponent.hp -= card.attack
-        else:  # Hit creatures
-            card_target = self.cards[action.idxTarget]
-
-            # breakthrough
-            if card.breakthrough:
-                if not card_target.ward:  # Breakthrough only when target is not Ward
-                    reminder = card.attack - card_target.defense
-                    if reminder >= 0: opponent.hp -= reminder
-
-            # Drain
-            if card_target.attack > 0:
-                if not card.ward and card_target.drain:
-                    opponent.hp += card.attack  # Drain only if mine is not Ward
-
-            if card.attack > 0:
-                if not card_target.ward and card.drain:
-                    my_player.hp += card.attack  # Drain only if target is not Ward
-
-            # Attack
-            my_player.do_attack(card=card, card_target=card_target)
-            opponent.do_attack(card=card_target, card_target=card)
-
-            if card.location == OutOfPlay: self.my_creatures_idxs.remove(card.idx)
-            if card_target.location == OutOfPlay: self.opponent_creatures_idxs.remove(card_target.idx)
-
-    def use(self, my_player, opponent, action):
-        card = self.cards[action.idx]
-        assert card.cost <= my_player.mana, log("Attempted to use a card without enough mana")
-        assert card.cardType != Creature, log("Attempted to use a creature card")
-
-        self.apply_global_effects(player=my_player, opponent=opponent, card=card)
-        card.location = OutOfPlay
-        my_player.mana -= self.cards[action.idx].cost
-        if action.idxTarget != OPPONENT_FACE:
-            card_target = self.cards[action.idxTarget]
-
-            # Keyword changes
-            if card.cardType == GreenItem:
-                card_target.breakthrough = card.breakthrough
-                card_target.drain = card.drain
-                card_target.ward = card.ward
-                card_target.guard = card.guard
-                card_target.lethal = card.lethal
-                card_target.charge = card.charge
-
-            elif card.cardType == RedItem:
-                if card.breakthrough: card_target.breakthrough = False
-                if card.ward: card_target.breakthrough = False
-                if card.guard: card_target.guard = False
-                if card.lethal: card_target.lethal = False
-                if card.charge: card_target.charge = False
-                if card.drain: card_target.drain = False
-
-            card_target.attack += card.attack
-
-            # Damage
-            # Check if the card is a damage and the target has Ward
-            if card.defense > 0:
-                card_target.defense += card.defense
-            else:
-                opponent.receive_damage(card=card_target, amount=-card.defense)
-                if card_target.location == OutOfPlay: self.opponent_creatures_idxs.remove(card_target.idx)
+        bit = 1 << idx
+        self.set(self.o_location + idx, SIDE_LOCATIONS[player_idx])
+        if data[HAND] & bit: self.set(HAND, data[HAND] & ~bit)
+        self.set(board, data[board] | bit)
+        keywords = data[self.o_keywords + idx]
+        if keywords & KW_GUARD: self.set(GUARD_MASKS[player_idx], data[GUARD_MASKS[player_idx]] | bit)
+        # Creature can attack once it has "Charge"
+        if keywords & KW_CHARGE:
+            self.set(self.o_can_attack + idx, 1)
+            self.set(READY_MASKS[player_idx], data[READY_MASKS[player_idx]] | bit)
+        else:
+            self.set(self.o_can_attack + idx, 0)
+        self.apply_global_effects(player_idx=player_idx, idx=idx)
+
+    def attack(self, idx, target_idx=OPPONENT_FACE, player_idx=0):
+        data = self.data
+        assert data[self.o_location + idx] == SIDE_LOCATIONS[player_idx], \
+            log("Attacking with an attacker that the player does not control")
+        if not data[self.o_can_attack + idx]: return
+
+        if target_idx == OPPONENT_FACE and data[GUARD_MASKS[1 - player_idx]]:
+            log("Attempting attacking a player when there is a guard on board", LOG_ERROR)
+
+        ready = READY_MASKS[player_idx]
+        self.set(self.o_can_attack + idx, 0)
+        self.set(ready, data[ready] & ~(1 << idx))
+        attack = data[self.o_attack + idx]
+        keywords = data[self.o_keywords + idx]
+        me = player_idx * PLAYER_FIELDS
+        opponent = (1 - player_idx) * PLAYER_FIELDS
+
+        if target_idx == OPPONENT_FACE:  # Hit face
+            if attack > 0:
+                self.set(opponent + P_HP, data[opponent + P_HP] - attack)
+                if keywords & KW_DRAIN: self.set(me + P_HP, data[me + P_HP] + attack)
+            return
+
+        # Hit creatures, both creatures deal their damage at the same time
+        target_attack = data[self.o_attack + target_idx]
+        target_defense = data[self.o_defense + target_idx]
+        target_keywords = data[self.o_keywords + target_idx]
+
+        dealt = self.receive_damage(target_idx, attack, lethal=keywords & KW_LETHAL)
+        self.receive_damage(idx, target_attack, lethal=target_keywords & KW_LETHAL)
+
+        if dealt > 0:
+            # Breakthrough only when target is not Ward
+            if keywords & KW_BREAKTHROUGH and attack > target_defense:
+                self.set(opponent + P_HP, data[opponent + P_HP] - (attack - target_defense))
+            # Drain only if the target is not Ward
+            if keywords & KW_DRAIN:
+                self.set(me + P_HP, data[me + P_HP] + attack)
+
+    def use(self, idx, target_idx=OPPONENT_FACE, player_idx=0):
+        data = self.data
+        card_type = self.types[idx]
+        assert data[self.o_cost + idx] <= data[player_idx * PLAYER_FIELDS + P_MANA], \
+            log("Attempted to use a card without enough mana")
+        assert card_type != Creature, log("Attempted to use a creature card")
+
+        # The item's own columns hold its modifiers
+        attack = data[self.o_attack + idx]
+        defense = data[self.o_defense + idx]
+        keywords = data[self.o_keywords + idx]
+
+        self.apply_global_effects(player_idx=player_idx, idx=idx)
+        self.set(self.o_location + idx, OutOfPlay)
+        if data[HAND] >> idx & 1: self.set(HAND, data[HAND] & ~(1 << idx))
+
+        if target_idx == OPPONENT_FACE:
+            if defense < 0:
+                opponent = (1 - player_idx) * PLAYER_FIELDS
+                self.set(opponent + P_HP, data[opponent + P_HP] + defense)
+            return
+
+        # Keyword changes
+        if card_type == GreenItem:
+            self.set(self.o_keywords + target_idx, data[self.o_keywords + target_idx] | keywords)
+            guards = GUARD_MASKS[player_idx]
+            if keywords & KW_GUARD: self.set(guards, data[guards] | 1 << target_idx)
+        else:
+            self.set(self.o_keywords + target_idx, data[self.o_keywords + target_idx] & ~keywords)
+            guards = GUARD_MASKS[1 - player_idx]
+            if keywords & KW_GUARD and data[guards] >> target_idx & 1:
+                self.set(guards, data[guards] & ~(1 << target_idx))
+
+        if attack: self.set(self.o_attack + target_idx, max(0, data[self.o_attack + target_idx] + attack))
+
+        # Damage
+        if defense > 0:
+            self.set(self.o_defense + target_idx, data[self.o_defense + target_idx] + defense)
+        else:
+            self.receive_damage(target_idx, -defense)
 
     def update_action(self, action, player_idx=0):
         """
-        For simulation one action
+        For simulation one (packed) action, undo() takes it back
         """
-        my_player = self.players[0]
-        opponent = self.players[1]
+        if STATS: start = time.perf_counter_ns()
+        self.undo_marks.append(len(self.trail))
+        self.hash_marks.append(self.hash)
+        data = self.data
+        guards = data[GUARDS]
+        my_creatures = data[MY_BOARD]
+        action_type = action >> ACTION_TYPE_SHIFT
+        idx = action >> ACTION_IDX_SHIFT & ACTION_IDX_MASK
+
+        if action_type == A_SUMMON:  # Summon a creature
+            self.summon(idx, player_idx=player_idx)
 
-        if action.type == ActionType.Summon:  # Summon either a creature and an item
-            self.summon(my_player=my_player, player_idx=player_idx, action=action, opponent=opponent)
+        elif action_type == A_USE:
+            self.use(idx, (action & ACTION_TARGET_MASK) - 1, player_idx=player_idx)
 
-        elif action.type == ActionType.Use:
-            self.use(my_player=my_player, opponent=opponent, action=action)
+        elif action_type == A_ATTACK:
+            self.attack(idx, (action & ACTION_TARGET_MASK) - 1, player_idx=player_idx)
 
-        elif action.type == ActionType.Attack:
-            self.attack(my_player=my_player, opponent=opponent, action=action, player_idx=player_idx)
+        # A guard gone or one of my creatures dead changes the legal actions, see is_pruned()
+        interacts = 1 if data[GUARDS] != guards or my_creatures & ~data[MY_BOARD] else 0
+        # Written without set(): both fields have zero Zobrist keys, the position does not depend on the order
+        self.trail += (LAST_ACTION, data[LAST_ACTION], LAST_INTERACTS, data[LAST_INTERACTS])
+        data[LAST_ACTION] = action
+        data[LAST_INTERACTS] = interacts
+        if STATS: _stats.simulate_ns += time.perf_counter_ns() - start
 
 
 class ActionType(Enum):
@@ -391,6 +1237,25 @@ class Action:
         self.idx = 0
         self.idxTarget = 0
 
+    @classmethod
+    def unpack(cls, code):
+        """
+        Build the Action of a packed action, for printing
+        """
+        action = cls()
+        action_type = code >> ACTION_TYPE_SHIFT
+        idx = code >> ACTION_IDX_SHIFT & ACTION_IDX_MASK
+        idxTarget = (code & ACTION_TARGET_MASK) - 1
+        if action_type == A_SUMMON:
+            action.summon(idx)
+        elif action_type == A_ATTACK:
+            action.attack(idx, idxTarget)
+        elif action_type == A_USE:
+            action.use(idx, idxTarget)
+        elif action_type == A_PICK:
+            action.pick(idx)
+        return action
+
     """ helper functions """
 
     def pass_(self):
@@ -419,35 +1284,30 @@ class Action:
             print("PASS")
 
         elif self.type == ActionType.Summon:
-            card = state.cards[self.idx]
-            print("SUMMON {}".format(card.id), end=ending)
+            print("SUMMON {}".format(state.ids[self.idx]), end=ending)
 
         elif self.type == ActionType.Attack:
-            card = state.cards[self.idx]
             if self.idxTarget == OPPONENT_FACE:
-                print("ATTACK {0} {1}".format(card.id, OPPONENT_FACE), end=ending)
+                print("ATTACK {0} {1}".format(state.ids[self.idx], OPPONENT_FACE), end=ending)
             else:
-                card_target = state.cards[self.idxTarget]
-                print("ATTACK {0} {1}".format(card.id, card_target.id), end=ending)
+                print("ATTACK {0} {1}".format(state.ids[self.idx], state.ids[self.idxTarget]), end=ending)
 
         elif self.type == ActionType.Pick:
             print("PICK {}".format(self.idx), end=ending)
 
         elif self.type == ActionType.Use:
-            card = state.cards[self.idx]
             if self.idxTarget == OPPONENT_FACE:
-                print("USE {0} {1}".format(card.id, OPPONENT_FACE), end=ending)
+                print("USE {0} {1}".format(state.ids[self.idx], OPPONENT_FACE), end=ending)
             else:
-                card_target = state.cards[self.idxTarget]
-                print("USE {0} {1}".format(card.id, card_target.id), end=ending)
+                print("USE {0} {1}".format(state.ids[self.idx], state.ids[self.idxTarget]), end=ending)
 
         else:
-            log("Action not found: {}".format(self.type))
+            log("Action not found: {}".format(self.type), LOG_ERROR)
             trap()
 
 
 class Turn:
-    """ Consists all actions to do in one turn """
+    """ Consists all actions to do in one turn, as packed actions """
 
     def __init__(self):
         self.actions = []
@@ -457,8 +1317,9 @@ class Turn:
 
     def isCardPlayed(self, idx):
         for action in self.actions:
-            if not (action.type == ActionType.Summon or action.type == ActionType.Use): continue
-            if action.idx == idx:
+            action_type = action >> ACTION_TYPE_SHIFT
+            if not (action_type == A_SUMMON or action_type == A_USE): continue
+            if action >> ACTION_IDX_SHIFT & ACTION_IDX_MASK == idx:
                 return True
         return False
 
@@ -471,46 +1332,683 @@ class Turn:
             return
 
         for i in range(len(self.actions)):
+            action = Action.unpack(self.actions[i])
             if i == len(self.actions) - 1:
-                self.actions[i].print(state, ending='\n')
+                action.print(state, ending='\n')
+            else:
+                action.print(state)
+
+
+class BatchEvaluator:
+    """
+    Scores end-of-turn positions in batches with NumPy, with the formula of Agent.eval_score.
+    The buffers of the leaves are copied back to back, so the batch is an N x len(State.data) matrix
+    and every card column is a slice of it.
+    """
+
+    def __init__(self, state, size=EVAL_BATCH_SIZE):
+        self.size = size
+        self.width = len(state.data)
+        self.n = state.n
+        self.o_location = state.o_location
+        self.o_attack = state.o_attack
+        self.o_defense = state.o_defense
+        self.leaves = array('q')
+        self.count = 0
+
+    def add(self, data):
+        """
+        Queue the buffer of a leaf, returns True once the batch is full
+        """
+        self.leaves.extend(data)
+        self.count += 1
+        return self.count >= self.size
+
+    def scores(self):
+        """
+        Score the queued leaves in the order they were added and empty the batch
+        """
+        if self.count == 0: return []
+        n = self.n
+        leaves = np.frombuffer(self.leaves, dtype=np.int64).reshape(self.count, self.width)
+        self.leaves = array('q')
+        self.count = 0
+
+        my_hp = leaves[:, P_HP]
+        opponent_hp = leaves[:, PLAYER_FIELDS + P_HP]
+        location = leaves[:, self.o_location:self.o_location + n]
+        stats = leaves[:, self.o_attack:self.o_attack + n] + leaves[:, self.o_defense:self.o_defense + n]
+        my_creatures_score = (stats * (location == Mine)).sum(axis=1) * 0.1
+        opponent_creatures_score = (stats * (location == Opponent)).sum(axis=1) * 0.1
+
+        scores = my_hp - opponent_hp + my_creatures_score - opponent_creatures_score - leaves[:, P_MANA] * 5.0
+        scores = np.where(opponent_hp <= 0, np.inf, scores)
+        scores = np.where(my_hp <= 0, -np.inf, scores)
+        return scores.tolist()
+
+
+class LethalSolver:
+    """
+    Finds a turn that kills the opponent, if there is one with the damage it knows of: the ready creatures and
+    the charge creatures summoned hitting the face, the hpChangeEnemy of the cards played, the blue items on the
+    face and the breakthrough spilling over the guards, once red items and attacks have cleared the guards.
+    The cards that only hit the face are a knapsack over mana and board slots, solved once. Every subset of the
+    other cards (charge creatures, red items on guards, green items on attackers) that fits in the mana left is
+    tried with every choice of targets, and the attackers are assigned to the guards by a search over the
+    guards' remaining defense and wards for enough face damage with every guard dead.
+    The turn found is replayed on a clone with every action checked against the legal ones, so what solve()
+    returns kills in the simulation. Past deadline_ns (perf_counter_ns) the solver gives up and finds nothing.
+    """
+
+    def __init__(self, state, deadline_ns=None):
+        self.state = state
+        self.plans = 0  # card and target combinations tried
+        self.assigned = set()  # (fighters, guards, hp) already assigned
+        self.deadline_ns = deadline_ns if deadline_ns is not None else time.perf_counter_ns() + LETHAL_BUDGET_NS
+
+    def is_elapsed(self):
+        return time.perf_counter_ns() >= self.deadline_ns
+
+    def solve(self):
+        """
+        Packed actions of a lethal turn, None if none was found in time
+        """
+        state = self.state
+        data = state.data
+        mana = data[P_MANA]
+        opponent_hp = data[PLAYER_FIELDS + P_HP]
+        slots = MAX_CREATURES_IN_PLAY - bin(data[MY_BOARD]).count('1')
+        guards = mask_to_idxs(data[GUARDS])
+
+        face_cards = []  # (idx, cost, slot, damage) of the cards that only hit the face
+        spells = []  # (idx, cost, damage) of the charge creatures and the items on guards or attackers
+        for idx in mask_to_idxs(data[HAND]):
+            cost = data[state.o_cost + idx]
+            if cost > mana: continue
+            card_type = state.types[idx]
+            damage = -state.hp_changes_enemy[idx]
+            keywords = data[state.o_keywords + idx]
+            if card_type == Creature:
+                if keywords & KW_CHARGE:
+                    if slots: spells.append((idx, cost, damage))
+                elif damage > 0 and slots:
+                    face_cards.append((idx, cost, 1, damage))
+            elif card_type == BlueItem:
+                damage -= min(0, data[state.o_defense + idx])
+                if damage > 0: face_cards.append((idx, cost, 0, damage))
+            elif card_type == RedItem:
+                if guards and (keywords & (KW_GUARD | KW_WARD) or data[state.o_defense + idx] < 0):
+                    spells.append((idx, cost, damage))
+            elif data[state.o_attack + idx] > 0 or keywords & (KW_BREAKTHROUGH | KW_LETHAL):
+                spells.append((idx, cost, damage))
+
+        # best[m][s]: (damage, idxs) of the face cards dealing the most damage with m mana and s slots at most
+        best = [[(0, ())] * (slots + 1) for _ in range(mana + 1)]
+        for idx, cost, slot, damage in face_cards:
+            for m in range(mana, cost - 1, -1):
+                row, previous = best[m], best[m - cost]
+                for s in range(slots, slot - 1, -1):
+                    candidate = previous[s - slot][0] + damage
+                    if candidate > row[s][0]: row[s] = (candidate, previous[s - slot][1] + (idx,))
+
+        ready = mask_to_idxs(data[READY])
+        # Fewest cards first
+        for subset in sorted(range(1 << len(spells)), key=lambda subset: bin(subset).count('1')):
+            if self.is_elapsed(): return None
+            chosen = [spells[i] for i in range(len(spells)) if subset >> i & 1]
+            cost = sum(spell[1] for spell in chosen)
+            if cost > mana: continue
+            charges = [spell[0] for spell in chosen if state.types[spell[0]] == Creature]
+            if len(charges) > slots: continue
+            face_damage, face_idxs = best[mana - cost][slots - len(charges)]
+            damage = face_damage + sum(spell[2] for spell in chosen)
+            actions = self.attack_plan(chosen, ready + tuple(charges), guards, opponent_hp - damage)
+            if actions is None: continue
+            summons = [pack_action(A_SUMMON, idx) for idx in face_idxs if state.types[idx] == Creature]
+            summons += [pack_action(A_SUMMON, idx) for idx in charges]
+            blue = [pack_action(A_USE, idx) for idx in face_idxs if state.types[idx] != Creature]
+            turn = summons + actions[0] + blue + actions[1]
+            if self.is_lethal(turn): return turn
+            if self.plans >= LETHAL_MAX_PLANS: break
+        return None
+
+    def attack_plan(self, chosen, attackers, guards, hp):
+        """
+        (item actions, attack actions) dealing hp damage with the chosen items on every choice of targets,
+        None if there is none
+        """
+        state = self.state
+        data = state.data
+        items = [spell[0] for spell in chosen if state.types[spell[0]] != Creature]
+        if hp <= 0 and not items: return [], []
+        targets = [guards if state.types[idx] == RedItem else attackers for idx in items]
+        max_attack = sum(max(0, data[state.o_attack + idx]) for idx in attackers + tuple(items))
+        if max_attack < hp: return None
+
+        for choice in itertools.product(*targets):
+            self.plans += 1
+            if self.plans > LETHAL_MAX_PLANS or self.is_elapsed(): return None
+            attack = {idx: data[state.o_attack + idx] for idx in attackers}
+            keywords = {idx: data[state.o_keywords + idx] for idx in attackers}
+            defense = {idx: data[state.o_defense + idx] for idx in guards}
+            ward = {idx: data[state.o_keywords + idx] & KW_WARD for idx in guards}
+            guard = {idx: True for idx in guards}
+            for idx, target in zip(items, choice):
+                item_keywords = data[state.o_keywords + idx]
+                if state.types[idx] == GreenItem:
+                    keywords[target] |= item_keywords
+                    attack[target] = max(0, attack[target] + data[state.o_attack + idx])
+                    continue
+                if item_keywords & KW_GUARD: guard[target] = False
+                if item_keywords & KW_WARD: ward[target] = 0
+                damage = -data[state.o_defense + idx]
+                if damage > 0:
+                    if ward[target]:
+                        ward[target] = 0
+                    else:
+                        defense[target] -= damage
+                        if defense[target] <= 0: guard[target] = False
+
+            fighters = tuple((idx, attack[idx], keywords[idx]) for idx in attackers)
+            alive = tuple((idx, defense[idx], bool(ward[idx])) for idx in guards if guard[idx])
+            key = (fighters, alive, hp)
+            if key in self.assigned: continue
+            self.assigned.add(key)
+            attacks = self.assign(fighters, alive, hp)
+            if attacks is None: continue
+            return ([pack_action(A_USE, idx, target) for idx, target in zip(items, choice)],
+                    [pack_action(A_ATTACK, idx, target) for idx, target in attacks])
+        return None
+
+    def assign(self, fighters, guards, hp):
+        """
+        Attacks (fighter idx, target) of the fighters (idx, attack, keywords) dealing hp to the face with the
+        guards (idx, defense, ward) dead first, None if there are none or the deadline passed
+        """
+        # failed: lowest damage needed that failed, by position, more fails too. reach: by fighters left, their
+        # positive attacks sorted and their keywords
+        return self.search_assignment(fighters, {}, {}, (1 << len(fighters)) - 1, guards, False, False, hp)
+
+    def search_assignment(self, fighters, failed, reach, left, guards, face, standing, need):
+        """
+        assign() for the fighters in the bitmask left and need damage still to deal, once one hit the face or
+        a guard was left standing. Hits on different guards commute: the first guard left is hit until it dies
+        or is left standing, and the lowest fighter left goes face or stays out.
+        """
+        if need <= 0 and not (face and (guards or standing)): return ()
+        if not left or face and standing: return None
+        key = (left, guards, face, standing)
+        if failed.get(key, need + 1) <= need: return None
+        reached = reach.get(left)
+        if reached is None:
+            keywords = 0
+            for i in mask_to_idxs(left): keywords |= fighters[i][2]
+            reached = reach[left] = (sorted(fighters[i][1] for i in mask_to_idxs(left) if fighters[i][1] > 0),
+                                     keywords)
+        attacks, keywords = reached
+        # Most face damage of the fighters left: the guards take a hit each and one more per ward
+        if keywords & KW_BREAKTHROUGH:
+            most = sum(attacks)
+        elif standing:  # no hit on the face
+            most = 0
+        else:  # the face is hit by the fighters left once every guard took its hits
+            wards = sum(guard[2] for guard in guards)
+            most = sum(attacks[len(guards) + wards:])
+            if not keywords & KW_LETHAL:
+                most = min(most, sum(attacks[wards:]) - sum(guard[1] for guard in guards))
+        if most < need or self.is_elapsed(): return None
+
+        search = self.search_assignment
+        low = left & -left
+        idx, attack, _ = fighters[low.bit_length() - 1]
+        if attack > 0 and not standing:
+            attacks = search(fighters, failed, reach, left ^ low, guards, True, standing, need - attack)
+            if attacks is not None: return attacks + ((idx, OPPONENT_FACE),)
+        attacks = search(fighters, failed, reach, left ^ low, guards, face, standing, need)
+        if attacks is not None: return attacks
+        if not guards:
+            failed[key] = need
+            return None
+
+        guard_idx, defense, ward = guards[0]
+        for i in mask_to_idxs(left):
+            idx, attack, keywords = fighters[i]
+            if attack <= 0: continue
+            if ward:
+                hit = ((guard_idx, defense, False),) + guards[1:]
+                spill = 0
+            else:
+                dead = keywords & KW_LETHAL or defense <= attack
+                hit = guards[1:] if dead else ((guard_idx, defense - attack, False),) + guards[1:]
+                spill = attack - defense if keywords & KW_BREAKTHROUGH and attack > defense else 0
+            attacks = search(fighters, failed, reach, left ^ 1 << i, hit, face, standing, need - spill)
+            if attacks is not None: return ((idx, guard_idx),) + attacks
+        if not face:
+            attacks = search(fighters, failed, reach, left, guards[1:], face, True, need)
+            if attacks is not None: return attacks
+        failed[key] = need
+        return None
+
+    def is_lethal(self, actions):
+        """
+        Whether the actions are legal one after the other and leave the opponent dead
+        """
+        state = self.state.clone()
+        for action in actions:
+            if action not in state.generateActions(): return False
+            state.update_action(action)
+        return state.hp(1) <= 0
+
+
+class CombatPlanner:
+    """
+    Attack assignment of the turn: each attacker hits a defender, the face or nothing, for the most value.
+    The attackers and defenders are (key, attack, defense, keywords), the attacks (attacker key, defender key or
+    OPPONENT_FACE) in the order they are made. Past deadline_ns (perf_counter_ns) the plan is the greedy one.
+    """
+
+    def __init__(self, attackers, defenders, deadline_ns=None):
+        self.attackers = attackers
+        self.defenders = sorted(defenders, key=lambda defender: not defender[3] & KW_GUARD)
+        self.guards = sum(1 for defender in defenders if defender[3] & KW_GUARD)
+        self.deadline_ns = deadline_ns if deadline_ns is not None else time.perf_counter_ns() + COMBAT_BUDGET_NS
+        self.elapsed = False  # the last plan ran out of time
+
+    def best_attacks(self, opponent_hp, hp_weight=COMBAT_HP_WEIGHT, stat_weight=COMBAT_STAT_WEIGHT,
+                     kill_bonus=COMBAT_KILL_BONUS, drain_weight=COMBAT_DRAIN_WEIGHT):
+        """
+        The attacks killing the opponent if there are some, the attacks of most value otherwise
+        """
+        # No more damage reaches the face than the attackers have, breakthrough included
+        if sum(attacker[1] for attacker in self.attackers if attacker[1] > 0) >= opponent_hp:
+            damage, attacks = self.plan(1.0, 0.0, 0.0, 0.0)
+            if damage >= opponent_hp: return list(attacks)
+        return list(self.plan(hp_weight, stat_weight, kill_bonus, drain_weight)[1])
+
+    @staticmethod
+    def hit(attacker, defender, defense, ward, hp_weight, stat_weight, kill_bonus, drain_weight):
+        """
+        (value, defense left) of a hit of the attacker on the defender with defense and ward left: the weights
+        are per point of damage to the face, of stats taken minus stats lost and of hp drained, and per kill
+        """
+        _, attack, attacker_defense, keywords = attacker
+        _, defender_attack, _, defender_keywords = defender
+        gain = 0.0
+        new_defense = defense
+        if not ward:
+            if keywords & KW_LETHAL or attack >= defense:
+                new_defense = 0
+                gain += stat_weight * (defender_attack + defense) + kill_bonus
+            else:
+                new_defense = defense - attack
+                gain += stat_weight * attack
+            if keywords & KW_BREAKTHROUGH and attack > defense: gain += hp_weight * (attack - defense)
+            if keywords & KW_DRAIN: gain += drain_weight * attack
+        if defender_attack > 0 and not keywords & KW_WARD:
+            if defender_keywords & KW_LETHAL or defender_attack >= attacker_defense:
+                gain -= stat_weight * (attack + attacker_defense) + kill_bonus
+            else:
+                gain -= stat_weight * defender_attack
+        return gain, new_defense
+
+    def plan(self, hp_weight, stat_weight, kill_bonus, drain_weight):
+        """
+        (value, attacks) of the most valuable attacks, of the greedy ones past the deadline
+        """
+        weights = (hp_weight, stat_weight, kill_bonus, drain_weight)
+        memo = {}
+        self.elapsed = False
+        if not self.defenders:
+            result = self.search(weights, memo, 0, (1 << len(self.attackers)) - 1, 0, False, True)
+        else:
+            _, _, defense, keywords = self.defenders[0]
+            result = self.search(weights, memo, 0, (1 << len(self.attackers)) - 1, defense,
+                                 bool(keywords & KW_WARD), True)
+        if self.elapsed: return self.greedy(*weights)
+        return result
+
+    def search(self, weights, memo, j, left, defense, ward, clear):
+        """
+        (value, attacks) of the attackers in the bitmask left from the defender j on, with the defense and ward
+        it has left, clear if every guard before it died. Hits on different defenders commute: they are taken
+        one after the other, guards first, each hit by every ordered sequence of the attackers left.
+        """
+        key = (j, left, defense, ward, clear)
+        result = memo.get(key)
+        if result is not None: return result
+        # The clock is read once per 32 positions
+        if self.elapsed or not len(memo) & 31 and time.perf_counter_ns() >= self.deadline_ns:
+            self.elapsed = True
+            return 0.0, ()
+
+        attackers = self.attackers
+        defenders = self.defenders
+        guards = self.guards
+        if j == guards and not clear:
+            result = (0.0, ())  # a guard lives: nothing else can be hit
+        elif j == len(defenders):
+            hp_weight, _, _, drain_weight = weights
+            value = 0.0
+            attacks = ()
+            for i in range(len(attackers)):
+                attacker_key, attack, _, keywords = attackers[i]
+                if not left >> i & 1 or attack <= 0: continue
+                value += hp_weight * attack + (drain_weight * attack if keywords & KW_DRAIN else 0.0)
+                attacks += ((attacker_key, OPPONENT_FACE),)
+            result = (value, attacks)
+        else:
+            # Done with the defender j
+            following = j + 1
+            next_clear = clear and (defense <= 0 or j >= guards)
+            if following < len(defenders):
+                _, _, next_defense, next_keywords = defenders[following]
+                result = self.search(weights, memo, following, left, next_defense, bool(next_keywords & KW_WARD),
+                                     next_clear)
             else:
-                self.actions[i].print(state)
+                result = self.search(weights, memo, following, left, 0, False, next_clear)
+
+            # Or one more hit on it
+            defender = defenders[j]
+            for i in range(len(attackers) if defense > 0 else 0):
+                attacker = attackers[i]
+                if not left >> i & 1 or attacker[1] <= 0: continue
+                gain, new_defense = self.hit(attacker, defender, defense, ward, *weights)
+                value, attacks = self.search(weights, memo, j, left ^ 1 << i, new_defense, False, clear)
+                if value + gain > result[0]:
+                    result = (value + gain, ((attacker[0], defender[0]),) + attacks)
+
+        memo[key] = result
+        return result
+
+    def greedy(self, hp_weight, stat_weight, kill_bonus, drain_weight):
+        """
+        (value, attacks) of the defenders taken in the same order, each hit by the attacker whose hit is worth
+        the most over hitting the face, while that is more than nothing, a guard until it dies, then the
+        attackers left on the face. Nothing else is hit once a guard lives.
+        """
+        left = [attacker for attacker in self.attackers if attacker[1] > 0]
+        value = 0.0
+        attacks = []
+
+        def face(attacker):
+            _, attack, _, keywords = attacker
+            return hp_weight * attack + (drain_weight * attack if keywords & KW_DRAIN else 0.0)
+
+        for j, defender in enumerate(self.defenders):
+            defense = defender[2]
+            ward = bool(defender[3] & KW_WARD)
+            while defense > 0 and left:
+                best = None  # (gain over the face, gain, attacker, defense left)
+                for attacker in left:
+                    gain, new_defense = self.hit(attacker, defender, defense, ward,
+                                                 hp_weight, stat_weight, kill_bonus, drain_weight)
+                    over = gain if j < self.guards else gain - face(attacker)
+                    if best is None or over > best[0]: best = (over, gain, attacker, new_defense)
+                over, gain, attacker, defense = best
+                if j >= self.guards and over <= 0: break
+                value += gain
+                attacks.append((attacker[0], defender[0]))
+                left.remove(attacker)
+                ward = False
+            if j < self.guards and defense > 0: return value, tuple(attacks)
+
+        for attacker in left:
+            value += face(attacker)
+            attacks.append((attacker[0], OPPONENT_FACE))
+        return value, tuple(attacks)
+
+
+class TreeNode:
+    """ A prefix of the turn's action sequence in the MCTS tree """
+    __slots__ = ('action', 'parent', 'children', 'untried', 'visits', 'total')
+
+    def __init__(self, action, parent, untried):
+        self.action = action  # packed action leading to this node, None at the root
+        self.parent = parent
+        self.children = []
+        self.untried = untried  # legal actions not expanded yet
+        self.visits = 0
+        self.total = 0.0  # sum of the rewards backed up through this node
+
+    def select_child(self):
+        """
+        UCT: the child maximising mean reward + exploration bonus
+        """
+        log_visits = math.log(self.visits)
+        best_child = None
+        best_value = -1.0
+        for child in self.children:
+            value = child.total / child.visits + MCTS_EXPLORATION * math.sqrt(log_visits / child.visits)
+            if value > best_value:
+                best_value = value
+                best_child = child
+        return best_child
 
 
 class ManaCurve:
-    def __init__(self):
-        self.curve = None
-        self.creature_count = None
+    """
+    Running histogram of the picks by cost bucket (the last bucket is 7+) and their number of creatures,
+    updated once per pick with add(). The distance to the target curve is kept along, so delta() scores
+    a candidate in O(1).
+    """
 
-    def compute_curve(self, cards):
-        self.curve = [0 for _ in range(MAX_MANA + 1)]
+    def __init__(self, targets=CURVE_TARGETS, creature_target=CREATURE_NUM, creature_weight=CREATURE_WEIGHT):
+        self.targets = targets
+        self.creature_target = creature_target
+        self.creature_weight = creature_weight
+        self.curve = [0] * len(targets)
         self.creature_count = 0
-        for card in cards:
-            self.curve[card.cost] += 1
-            if card.cardType == Creature:
-                self.creature_count += 1
+        self.score = sum(targets) + creature_weight * creature_target  # distance of the empty curve
 
-    def evaluate_score(self):
+    def delta(self, cost, creature):
         """
-        Calculate the total score of the drafted cards depending on its mana cost
+        Change of evaluate_score() if a card of this cost was added
         """
-        seven_plus = 0
-        for i in range(7, MAX_MANA + 1):
-            seven_plus += self.curve[i]
+        bucket = min(cost, len(self.targets) - 1)
+        count = self.curve[bucket]
+        target = self.targets[bucket]
+        delta = abs(count + 1 - target) - abs(count - target)
+        if creature:
+            delta += self.creature_weight * (abs(self.creature_count + 1 - self.creature_target) -
+                                             abs(self.creature_count - self.creature_target))
+        return delta
+
+    def add(self, cost, creature):
+        self.score += self.delta(cost, creature)
+        self.curve[min(cost, len(self.targets) - 1)] += 1
+        if creature: self.creature_count += 1
 
-        return abs(self.curve[0] - ZERO) + abs(self.curve[1] - ONE) + abs(self.curve[2] - TWO) + abs(
-            self.curve[3] - THREE) + abs(self.curve[4] - FOUR) + abs(self.curve[5] - FIVE) + abs(
-            self.curve[6] - SIX) + abs(seven_plus - SEVEN_PLUS) + 10 * abs(self.creature_count - CREATURE_NUM)
+    def evaluate_score(self):
+        """
+        Distance of the picks to the target curve and number of creatures, lower is better
+        """
+        return self.score
 
     def print(self):
-        log(self.curve)
+        log(self.curve, LOG_DEBUG)
+
+
+def score_by_curve(engine, card):
+    """
+    How much closer to the target curve the picks get with the card
+    """
+    return -engine.curve.delta(card.cost, card.cardType == Creature)
+
+
+def score_by_card(engine, card):
+    """
+    Static value of a creature in the card database, 0 for an item
+    """
+    return engine.db.values[card.cardId] if card.cardType == Creature else 0
+
+
+def score_by_lookahead(engine, card):
+    """
+    Expected quality of the final deck if the card is picked, see DraftLookahead
+    """
+    lookahead = engine.lookahead
+    if lookahead is None or not lookahead.sample(engine):
+        return score_by_card(engine, card) if len(engine.picks) < CARD_VALUE_PICKS else score_by_curve(engine, card)
+    return lookahead.quality(engine.curve, card)
+
+
+# The scorer of each pick: (number of picks it is used before, scorer)
+DRAFT_SCORERS = ((DRAFT_PICKS, score_by_lookahead),)
+
+
+class DraftLookahead:
+    """
+    Estimates the quality of the final deck, LOOKAHEAD_VALUE_WEIGHT * value of its creatures - distance to the
+    mana curve, by sampling the rest of the draft.
+    A completion is one offer of CARDS_PER_DRAFT cards per pick left, drawn from the distinct cards seen so far
+    (the offers are drawn from the whole pool, so these are a sample of it), where the creature of highest value
+    is picked. The completions are sampled once per pick and shared by the cards offered, so the scores of the
+    offer differ by the card only, and they are scored all at once with NumPy.
+    """
+
+    def __init__(self, db, samples=LOOKAHEAD_SAMPLES):
+        self.db = db
+        self.samples = samples
+        self.rng = None
+        self.picks = -1  # picks made when the completions were sampled
+        self.base_quality = None  # per completion: quality of the deck without the card, the picks' values aside
+        self.counts = None  # per completion: number of cards of each cost bucket
+        self.creatures = None  # per completion: number of creatures
+
+    def sample(self, engine):
+        """
+        Sample the completions of the draft for the current pick, False if too few cards have been seen
+        """
+        if self.picks == len(engine.picks): return True
+        db = self.db
+        pool = [number for number, known in enumerate(db.known) if known]
+        if len(pool) < LOOKAHEAD_MIN_POOL: return False
+        if self.rng is None: self.rng = np.random.default_rng(random.getrandbits(62))
+
+        curve = engine.curve
+        buckets = len(curve.targets)
+        pool = np.array(pool)
+        values = np.array([db.values[number] if db.types[number] == Creature else 0.0 for number in pool])
+        creature = np.array([db.types[number] == Creature for number in pool])
+        cost_buckets = np.minimum(np.array([db.costs[number] for number in pool]), buckets - 1)
+
+        picks_left = DRAFT_PICKS - len(engine.picks) - 1
+        samples = self.samples if picks_left > 0 else 1
+        offers = self.rng.integers(0, len(pool), size=(samples, picks_left, CARDS_PER_DRAFT))
+        chosen = values[offers].argmax(axis=2)
+        picked = np.take_along_axis(offers, chosen[:, :, None], axis=2)[:, :, 0]
+
+        rows = np.repeat(np.arange(samples), picks_left)
+        counts = np.bincount(rows * buckets + cost_buckets[picked].ravel(), minlength=samples * buckets)
+        self.counts = counts.reshape(samples, buckets) + np.array(curve.curve)
+        self.creatures = creature[picked].sum(axis=1) + curve.creature_count
+        distance = np.abs(self.counts - np.array(curve.targets)).sum(axis=1) + \
+            curve.creature_weight * np.abs(self.creatures - curve.creature_target)
+        self.base_quality = LOOKAHEAD_VALUE_WEIGHT * values[picked].sum(axis=1) - distance
+        self.picks = len(engine.picks)
+        return True
+
+    def quality(self, curve, card):
+        """
+        Mean quality of the final deck over the completions if the card is picked now
+        """
+        bucket = min(card.cost, len(curve.targets) - 1)
+        count = self.counts[:, bucket]
+        target = curve.targets[bucket]
+        distance = np.abs(count + 1 - target) - np.abs(count - target)
+        value = 0.0
+        if card.cardType == Creature:
+            value = self.db.values[card.cardId]
+            distance = distance + curve.creature_weight * (np.abs(self.creatures + 1 - curve.creature_target) -
+                                                           np.abs(self.creatures - curve.creature_target))
+        return float((self.base_quality - distance).mean()) + LOOKAHEAD_VALUE_WEIGHT * value
+
+
+class DraftEngine:
+    """
+    Draft: the cards offered are scored by the scorer of the pick (see DRAFT_SCORERS), higher is better,
+    and the first best one is picked and added to the mana curve.
+    A scorer is a function (engine, card) -> score, it can use the curve and the picks so far.
+    """
+
+    def __init__(self, scorers=None, db=None):
+        self.scorers = scorers if scorers is not None else DRAFT_SCORERS
+        self.db = db  # CardDatabase of the bot
+        self.lookahead = DraftLookahead(db) if db is not None and np is not None else None
+        self.curve = ManaCurve()
+        self.picks = []
+
+    def scorer(self):
+        for picks, scorer in self.scorers:
+            if len(self.picks) < picks: return scorer
+        return self.scorers[-1][1]
+
+    def pick(self, cards):
+        """
+        Index of the card picked among the offer
+        """
+        scorer = self.scorer()
+        best_pick = 0
+        best_score = -float('inf')
+        for i, card in enumerate(cards):
+            score = scorer(self, card)
+            if score > best_score:
+                best_pick = i
+                best_score = score
+        self.add(cards[best_pick])
+        return best_pick
+
+    def add(self, card):
+        self.picks.append(card)
+        self.curve.add(card.cost, card.cardType == Creature)
+
+
+def action_priority(state, action):
+    """
+    Rollout priority of one of my legal actions, the higher the likelier, and below 0 the rollout rather ends the
+    turn.
+    The cards come first by cost, the greedy summon order of heuristic_bot: eval_score charges the mana left.
+    The attacks go by trade, with the weights of the CombatPlanner: the damage to the face, or for an attack
+    on a creature the damage it will not deal in the opponent's turn if it dies and the stats taken from it,
+    less the stats of the attacker if it dies.
+    """
+    data = state.data
+    idx = action >> ACTION_IDX_SHIFT & ACTION_IDX_MASK
+    target = (action & ACTION_TARGET_MASK) - 1
+    if action >> ACTION_TYPE_SHIFT != A_ATTACK: return ROLLOUT_CARD_PRIORITY + data[state.o_cost + idx]
+
+    o_attack = state.o_attack
+    o_defense = state.o_defense
+    o_keywords = state.o_keywords
+    attack = data[o_attack + idx]
+    keywords = data[o_keywords + idx]
+    drain = COMBAT_DRAIN_WEIGHT * attack if keywords & KW_DRAIN else 0
+    if target == OPPONENT_FACE: return COMBAT_HP_WEIGHT * attack + drain
+
+    defense = data[o_defense + idx]
+    target_attack = data[o_attack + target]
+    target_defense = data[o_defense + target]
+    target_keywords = data[o_keywords + target]
+    if target_keywords & KW_WARD:
+        priority = 0.0  # the ward pops, nothing else
+    elif keywords & KW_LETHAL and attack > 0 or attack >= target_defense:
+        priority = COMBAT_HP_WEIGHT * target_attack + COMBAT_STAT_WEIGHT * (target_attack + target_defense) + \
+            COMBAT_KILL_BONUS + drain
+    else:
+        priority = COMBAT_STAT_WEIGHT * attack + drain
+    if target_attack > 0 and not keywords & KW_WARD and (target_keywords & KW_LETHAL or target_attack >= defense):
+        priority -= COMBAT_STAT_WEIGHT * (attack + defense) + COMBAT_KILL_BONUS
+    return priority
+
+
+ROLLOUT_PRIORITY = action_priority  # priorities of the rollout policy, None for uniform random rollouts
 
 
 class Agent:
-    def __init__(self):
+    def __init__(self, search_mode=SEARCH_MODE):
         self.state = State()
+        self.search_mode = search_mode
         self.bestTurn = Turn()  # best turn actions found
-        self.drafted_cards = []
         self.my_creatures = []
         self.enemy_creatures = []
         self.enemy_guards = []
@@ -519,8 +2017,20 @@ class Agent:
         self.rnd = Random()
 
         self.timeout = Timeout()
+        self.reader = InputReader()
+        self.card_db = CardDatabase()
+        self.draft_engine = DraftEngine(db=self.card_db)
+
+        self.scores = TranspositionTable()  # eval_score of the end-of-turn positions
+        self.tree_positions = TranspositionTable()  # positions already reached in the MCTS tree
+        self.reply_scores = TranspositionTable()  # two-ply score of the final positions, see reply()
+        self.attack_plans = TranspositionTable()  # opponent attacks by CombatPlanner input, see reply()
 
-        self.draft_turns = 0
+        self.best_score = -float('inf')  # eval_score of bestTurn, set by the searches
+        self.root = None  # root of the last MCTS tree
+        self.combat_plan = []  # packed attacks of the CombatPlanner for the position searched
+        self.planned = frozenset()  # the same attacks, the actions the searches try first
+        self.pool = None  # search workers, see parallel_think()
 
     def reset(self):
         self.my_creatures.clear()
@@ -529,232 +2039,598 @@ class Agent:
         self.enemy_non_guards.clear()
 
     def getRandomAction(self, state, player_idx=0):
-        actions = state.generateActions(player_idx)
-        if len(actions) == 0: return None
-        action_idx = self.rnd.get_random_int(upper_bound=len(actions) - 1)
-        action = actions[action_idx]
+        """
+        The next action of a rollout, None to end the turn: a uniform draw among the canonical actions (see
+        is_pruned()) with probability ROLLOUT_EPSILON, else a draw of policy_action().
+        """
+        if ROLLOUT_PRIORITY is not None and random.random() >= ROLLOUT_EPSILON: return self.policy_action(state)
+        if STATS: start = time.perf_counter_ns()
+        count = state.count_actions()
+        action = state.action_at(self.rnd.get_random_int(upper_bound=count - 1)) if count else None
+        if action is not None and CANONICAL_ORDERING and state.can_prune() and state.is_pruned(action):
+            # Rejection sampling keeps the draw uniform over the canonical actions, list them if it keeps failing
+            for _ in range(PRUNING_RETRIES):
+                action = state.action_at(self.rnd.get_random_int(upper_bound=count - 1))
+                if not state.is_pruned(action): break
+            else:
+                actions = state.canonical_actions()
+                action = actions[self.rnd.get_random_int(upper_bound=len(actions) - 1)]
+        if STATS:
+            _stats.generate_ns += time.perf_counter_ns() - start
+            _stats.decisions += 1
+            _stats.legal_actions += count
+        return action
+
+    def policy_action(self, state):
+        """
+        A legal action drawn with weight exp(ROLLOUT_PRIORITY / ROLLOUT_TEMPERATURE) among those of priority 0 or
+        more, None if there is none. The draw lists all the legal actions, the canonical order would hide some.
+        """
+        if STATS: start = time.perf_counter_ns()
+        actions = state.generateActions()
+        candidates = []
+        priorities = []
+        for action in actions:
+            priority = ROLLOUT_PRIORITY(state, action)
+            if priority >= 0:
+                candidates.append(action)
+                priorities.append(priority)
+        action = None
+        if candidates:
+            top = max(priorities)
+            weights = [math.exp((priority - top) / ROLLOUT_TEMPERATURE) for priority in priorities]
+            action = random.choices(candidates, weights)[0]
+        if STATS:
+            _stats.generate_ns += time.perf_counter_ns() - start
+            _stats.decisions += 1
+            _stats.legal_actions += len(actions)
         return action
 
+    def node_actions(self, state):
+        """
+        The actions a search node expands
+        """
+        if STATS: start = time.perf_counter_ns()
+        actions = list(state.canonical_actions() if CANONICAL_ORDERING else state.generateActions())
+        if self.planned: actions.sort(key=lambda action: action not in self.planned)
+        if STATS:
+            _stats.generate_ns += time.perf_counter_ns() - start
+            _stats.decisions += 1
+            _stats.legal_actions += len(actions)
+        return actions
+
     def print(self):
         """
         print the bestTurn (best actions found)
         """
         self.bestTurn.print(self.state)
+        sys.stdout.flush()
+        self.timeout.mark(PHASE_OUTPUT)
+        log(self.timeout.phase_summary(), LOG_DEBUG)
+        if STATS:
+            mode = "draft" if self.state.isInDraft() else self.search_mode
+            _stats.write(self.timeout.turns, mode, self.timeout, len(self.bestTurn.actions))
 
     def read(self):
         """
         Read all inputs
         :return: None
         """
+        reader = self.reader
+        state = self.state
 
         """ read players info """
+        lines = [reader.line()]
+        # The referee's clock runs from the moment it sent the turn, not from when we are done parsing. My mana
+        # is 0 in the draft only, see State.isInDraft().
+        self.timeout.start(draft=int(lines[0].split()[1]) == 0)
+        lines.append(reader.line())
         for i in range(2):
-            player = self.state.players[i]
-            player.hp, player.mana, player.cardsRemaining, player.rune, player.draw = [int(j) for j in input().split()]
+            player = state.players[i]
+            player.hp, player.mana, player.cardsRemaining, player.rune, player.draw = map(int, lines[i].split())
 
         """ read opponent hand cards info """
-        self.state.opponent_hand, self.state.opponent_actions = [int(i) for i in input().split()]
+        state.opponent_hand, state.opponent_actions = map(int, reader.line().split())
 
         """ read more opponent hand cards info """
-        self.state.card_number_and_action_list = []
-        for i in range(self.state.opponent_actions):
-            card_number_and_action = input()
-            self.state.card_number_and_action_list.append(card_number_and_action)
+        state.card_number_and_action_list = [line.decode().strip() for line in
+                                             reader.read_lines(state.opponent_actions)]
 
         """ read cards info """
-        self.state.cards.clear()  # clear the card list every turn
-
-        self.state.my_creatures_idxs.clear()
-        self.state.opponent_creatures_idxs.clear()
-
-        card_count = int(input())
-        # read every card
-        for i in range(card_count):
-            card = Card()
-            card.idx = i
-            inputs = input().split()
-            card_number = int(inputs[0])
-            instance_id = int(inputs[1])
-            location = int(inputs[2])
-            card_type = int(inputs[3])
-            cost = int(inputs[4])
-            attack = int(inputs[5])
-            defense = int(inputs[6])
-            abilities = inputs[
-                7]  # the abilities of a card. Each letter representing an ability (B for Breakthrough, C for Charge and G for Guard)
-            my_health_change = int(inputs[8])
-            opponent_health_change = int(inputs[9])
-            card_draw = int(inputs[10])
-
-            card.cardId = card_number
-            card.id = instance_id
-            card.location = location
-            card.cardType = card_type
-            card.cost = cost
-            card.attack = attack
-            card.defense = defense
-            card.hpChange = my_health_change
-            card.hpChangeEnemy = opponent_health_change
-            card.cardDraw = card_draw
-
-            # abilities: 'BCG---'
-            for c in abilities:
-                if c == 'B': card.breakthrough = True
-                if c == 'C': card.charge = True
-                if c == 'G': card.guard = True
-                if c == 'D': card.drain = True
-                if c == 'W': card.ward = True
-                if c == 'L': card.lethal = True
-
-            if card.location == Mine or card.location == Opponent:
-                card.canAttack = True
+        card_count = int(reader.line())
+        # Split all the card lines at once, then convert the fields column by column
+        fields = b' '.join(reader.read_lines(card_count)).split()
+        card_numbers = list(map(int, fields[IN_CARD_NUMBER::INPUT_CARD_FIELDS]))
+        # Once all the cards are in the card database only the fields that change are parsed
+        db = self.card_db
+        known = db.knows(card_numbers)
+        columns = []
+        for field in range(INPUT_CARD_FIELDS):
+            if field == IN_CARD_NUMBER:
+                columns.append(card_numbers)
+            elif field == IN_ABILITIES:
+                columns.append([abilities_mask(abilities) for abilities in fields[field::INPUT_CARD_FIELDS]])
+            elif known and field in STATIC_FIELDS:
+                table = getattr(db, STATIC_FIELDS[field])
+                columns.append([table[number] for number in card_numbers])
             else:
-                card.canAttack = False
-
-            if card.cardType == Creature and card.location == Mine:
-                self.state.my_creatures_idxs.append(card.idx)
-            elif card.cardType == Creature and card.location == Opponent:
-                self.state.opponent_creatures_idxs.append(card.idx)
-
-            self.state.cards.append(card)
+                columns.append(list(map(int, fields[field::INPUT_CARD_FIELDS])))
+        if not known: db.learn(columns)
 
-        # Start the timeout after done reading
-        self.timeout.start()
+        state.load(columns)
+        self.timeout.mark(PHASE_PARSE)
 
     def debug(self):
-        log("My Creatures: ")
-        for creature in self.state.cards:
-            if creature.location == Mine:
-                log("att: {}, def: {}, canAttack:{}".format(creature.attack, creature.defense, creature.canAttack))
+        if LOG_LEVEL < LOG_DEBUG: return
+        log("My Creatures: ", LOG_DEBUG)
+        for idx in self.state.my_creatures_idxs:
+            creature = self.state.card(idx)
+            log("att: {}, def: {}, canAttack:{}".format(creature.attack, creature.defense, creature.canAttack),
+                LOG_DEBUG)
+
+    def evaluate(self, state):
+        """
+        eval_score through the transposition table, a position reached again is not scored twice
+        """
+        score = self.scores.get(state.hash)
+        if score is None:
+            if STATS: start = time.perf_counter_ns()
+            score = self.eval_score(state)
+            self.scores.put(state.hash, score)
+            if STATS:
+                _stats.evaluate_ns += time.perf_counter_ns() - start
+                _stats.evaluations += 1
+        elif STATS:
+            _stats.tt_hits += 1
+        return score
 
     def eval_score(self, state):
-        my_player = state.players[0]
-        opponent = state.players[1]
+        data = state.data
+        my_hp = data[P_HP]
+        opponent_hp = data[PLAYER_FIELDS + P_HP]
 
-        if my_player.hp <= 0: return -float('inf')
-        if opponent.hp <= 0: return float('inf')
+        if my_hp <= 0: return -float('inf')
+        if opponent_hp <= 0: return float('inf')
 
-        hp_score = 0
-        hp_score += my_player.hp
-        hp_score -= opponent.hp
+        hp_score = my_hp - opponent_hp
 
         my_creatures_score = 0
         opponent_creatures_score = 0
 
         # Iterate through all creatures on the board
-        for creature in self.state.cards:
-            if creature.location == Mine:
-                my_creatures_score += creature.attack
-                my_creatures_score += creature.defense
+        for idx in mask_to_idxs(data[MY_BOARD]):
+            my_creatures_score += data[state.o_attack + idx]
+            my_creatures_score += data[state.o_defense + idx]
 
-            elif creature.location == Opponent:
-                opponent_creatures_score += creature.attack
-                opponent_creatures_score += creature.defense
+        for idx in mask_to_idxs(data[OPPONENT_BOARD]):
+            opponent_creatures_score += data[state.o_attack + idx]
+            opponent_creatures_score += data[state.o_defense + idx]
 
         my_creatures_score *= 0.1
         opponent_creatures_score *= 0.1
 
-        overall_score = hp_score + my_creatures_score - opponent_creatures_score - state.players[0].mana * 5
+        overall_score = hp_score + my_creatures_score - opponent_creatures_score - data[P_MANA] * 5
 
         return overall_score
 
     def draft(self):
-        curve = ManaCurve()
-        # compute the scores for the three choices
-        bestScore = float('inf')
-        bestPick = None
-        for i in range(CARDS_PER_DRAFT):
-            card = self.state.cards[i]
-            curve.compute_curve(self.drafted_cards)
-            curve.curve[card.cost] += 1
-            if card.cardType == Creature: curve.creature_count += 1
-
-            score = curve.evaluate_score()
-            curve.curve[card.cost] -= 1
-            if card.cardType == Creature: curve.creature_count -= 1
-
-            if score < bestScore:
-                bestScore = score
-                bestPick = i
-
-        action = Action()
-        action.pick(idx=bestPick)
-        self.bestTurn.actions.append(action)
-        self.drafted_cards.append(self.state.cards[bestPick])
-        self.draft_turns += 1
-        curve.print()
-
-    def draft_by_card(self):
+        cards = [self.state.card(i) for i in range(CARDS_PER_DRAFT)]
+        self.bestTurn.actions.append(pack_action(A_PICK, self.draft_engine.pick(cards)))
+        self.draft_engine.curve.print()
 
-        self.bestTurn.clear()
-
-        bestScore = -float('inf')
-        bestPick = None
-        for i in range(CARDS_PER_DRAFT):
-            card = self.state.cards[i]
-
-            if card.cardType == Creature:
-                card_score = card.attack + card.defense - card.cost * 2
-
-                if card.ward:
-                    card_score += 1.5
-                if card.drain:
-                    card_score += 1.05
-                if card.lethal:
-                    card_score += 1.3
-                if card.guard:
-                    card_score += 1.15
+    def random_think(self):
+        """
+        Flat random rollouts, keep the best complete turn.
+        With NumPy the leaves not in the transposition table are scored in batches.
+        """
+        best_score = -float('inf')
+
+        # Every rollout plays on self.state and is taken back, so each one starts from the observed state
+        state = self.state
+        batch = BatchEvaluator(state) if np is not None and EVAL_BATCH_SIZE > 1 else None
+        pending = []  # (hash, turn) of the leaves queued in the batch
+
+        def score_batch():
+            nonlocal best_score
+            if STATS: start = time.perf_counter_ns()
+            scores = batch.scores()
+            if STATS:
+                _stats.evaluate_ns += time.perf_counter_ns() - start
+                _stats.evaluations += len(scores)
+            for (position, pending_turn), batch_score in zip(pending, scores):
+                self.scores.put(position, batch_score)
+                if TWO_PLY and batch_score > best_score:
+                    # The batch is scored back at the root, a leaf that may improve is replayed for its reply
+                    for action in pending_turn.actions:
+                        state.update_action(action)
+                    batch_score = self.reply(state, batch_score, best_score)
+                    for _ in pending_turn.actions:
+                        state.undo()
+                if batch_score > best_score:
+                    best_score = batch_score
+                    self.bestTurn = pending_turn
+                    if STATS: _stats.improved(self.timeout, batch_score)
+            pending.clear()
+
+        planned = self.combat_plan  # the first rollout starts with the planned attacks
+        while not self.timeout.tick():
+            turn = Turn()
+            for action in planned:
+                if action not in state.generateActions(): break
+                turn.actions.append(action)
+                state.update_action(action)
+            planned = ()
+            while True:
+
+                action = self.getRandomAction(state)
+
+                if action is None:
+                    break
+
+                turn.actions.append(action)
+                state.update_action(action=action, player_idx=0)
+
+            if STATS: _stats.rollout(len(turn.actions))
+            full = False
+            if batch is not None and self.scores.get(state.hash) is None:
+                pending.append((state.hash, turn))
+                full = batch.add(state.data)
             else:
-                card_score = 0
+                score = self.reply(state, self.evaluate(state), best_score)
+                if score > best_score:
+                    best_score = score
+                    self.bestTurn = turn
+                    if STATS: _stats.improved(self.timeout, score)
+
+            state.undo_all()
+            if full: score_batch()
 
-            if card_score > bestScore:
-                bestPick = i
-                bestScore = card_score
+        if pending: score_batch()
+        self.best_score = best_score
+
+    @classmethod
+    def reward(cls, score, root_score):
+        """
+        Squash the eval_score gain over the root into [0, 1] for the MCTS statistics
+        """
+        if score == float('inf'): return 1.0
+        if score == -float('inf'): return 0.0
+        return 1.0 / (1.0 + math.exp(max(-50.0, min(50.0, (root_score - score) / MCTS_SCORE_SCALE))))
+
+    def mcts_think(self):
+        """
+        Monte Carlo Tree Search over the action sequence of the turn: UCT selection, expansion of one
+        legal action, random rollout to the end of the turn, backup of the eval_score reward.
+        An expansion reaching a position already in the tree (the same actions in another order) is dropped.
+        The best complete turn seen by any iteration is played.
+        """
+        self.tree_positions.clear()
+        best_score = -float('inf')
+
+        state = self.state
+        root_score = self.eval_score(state)
+        if abs(root_score) == float('inf'): root_score = 0.0
+        root = TreeNode(None, None, self.node_actions(state))
+        self.root = root
+        self.tree_positions.put(state.hash, root)
+        while not self.timeout.tick():
+            turn = Turn()
+            node = root
+
+            # Selection
+            while not node.untried and node.children:
+                node = node.select_child()
+                turn.actions.append(node.action)
+                state.update_action(node.action)
+
+            # Expansion
+            while node.untried:
+                # node_actions() puts the planned attacks first, they are expanded before the others
+                first = 0 if node.untried[0] in self.planned else self.rnd.get_random_int(len(node.untried) - 1)
+                action = node.untried.pop(first)
+                state.update_action(action)
+                if self.tree_positions.get(state.hash) is not None:
+                    state.undo()  # transposition, this position is searched from its other node
+                    continue
+                turn.actions.append(action)
+                child = TreeNode(action, node, self.node_actions(state))
+                self.tree_positions.put(state.hash, child)
+                node.children.append(child)
+                node = child
+                break
+
+            # Rollout
+            while True:
+                action = self.getRandomAction(state)
+                if action is None:
+                    break
+                turn.actions.append(action)
+                state.update_action(action)
+
+            if STATS: _stats.rollout(len(turn.actions))
+            score = self.evaluate(state)
+            # The tree backs up the static score, the turn played is the best after the reply
+            best = self.reply(state, score, best_score)
+            if best > best_score:
+                best_score = best
+                self.bestTurn = turn
+                if STATS: _stats.improved(self.timeout, best)
+
+            # Backpropagation
+            reward = self.reward(score, root_score)
+            while node is not None:
+                node.visits += 1
+                node.total += reward
+                node = node.parent
+
+            state.undo_all()
+
+        self.best_score = best_score
+
+    def beam_width(self, step_time, children, beams):
+        """
+        Width of the next beam step: the time left split over the steps still to come, each of them costing
+        about the time of a child of the last step times the children a partial turn has
+        """
+        if children == 0: return BEAM_MAX_WIDTH
+        per_child = step_time / children
+        branching = children / len(beams)
+        # every action plays a card from hand or attacks once, which bounds the steps left
+        data = beams[0][2].data
+        steps_left = max(1, bin(data[HAND]).count('1') + bin(data[READY]).count('1'))
+        width = int(self.timeout.remaining() / (per_child * branching * steps_left))
+        return max(1, min(BEAM_MAX_WIDTH, width))
+
+    def beam_think(self):
+        """
+        Beam search: the width best partial turns by eval_score are expanded with every legal action at each
+        step, until no partial turn has a legal action left. The width follows the time left, and when the time
+        runs out, in a step too, the best partial turn of the last step is finished with random actions.
+        """
+        best_score = -float('inf')
+        best_actions = None
+
+        beams = [(self.evaluate(self.state), [], self.state)]
+        best_partial = beams[0]  # (score, actions, state) to finish if the time runs out
+        width = BEAM_MAX_WIDTH
+        elapsed = False
+        while beams:
+            if self.timeout.is_elapsed():
+                elapsed = True
+                break
+            step_start = time.perf_counter()
+            children = []
+            seen = set()  # positions reached by several beams in the step, expanded once
+            for score, actions, state in beams:
+                if self.timeout.tick():
+                    elapsed = True
+                    break
+                legal = self.node_actions(state)
+                if not legal:
+                    if STATS: _stats.rollout(len(actions))
+                    score = self.reply(state, score, best_score)
+                    if score > best_score:
+                        best_score = score
+                        best_actions = actions
+                        if STATS: _stats.improved(self.timeout, score)
+                    continue
+
+                for action in legal:
+                    state.update_action(action)
+                    if state.hash not in seen:
+                        seen.add(state.hash)
+                        children.append((self.evaluate(state), action, actions, state))
+                    state.undo()
+
+            if elapsed or not children: break
+            children.sort(key=lambda child: child[0], reverse=True)
+            width = self.beam_width(time.perf_counter() - step_start, len(children), beams)
+
+            beams = []
+            for score, action, actions, parent in children[:width]:
+                state = parent.clone()
+                state.update_action(action)
+                beams.append((score, actions + [action], state))
+            best_partial = beams[0]
+
+        if elapsed:
+            # Out of time: finish the best partial turn, it is scored like the finished ones (see reply())
+            _, actions, state = best_partial
+            actions = list(actions)
+            state = state.clone()
+            while True:
+                action = self.getRandomAction(state)
+                if action is None: break
+                actions.append(action)
+                state.update_action(action)
+            if STATS: _stats.rollout(len(actions))
+            score = self.reply(state, self.evaluate(state), best_score)
+            if score > best_score:
+                best_score = score
+                best_actions = actions
+                if STATS: _stats.improved(self.timeout, score)
+
+        if best_actions is not None:
+            self.bestTurn.actions = best_actions
+        self.best_score = best_score
+
+    def search(self):
+        """
+        Run the search of self.search_mode on self.state.
+        Returns (best score, best actions, (action, visits) of the MCTS root children)
+        """
+        self.combat_plan = self.plan_attacks(self.state) if COMBAT_ORDERING else []
+        self.planned = frozenset(self.combat_plan)
+        self.reply_scores.clear()
+        self.attack_plans.clear()
+        if self.search_mode == SEARCH_MCTS:
+            self.mcts_think()
+            visits = [(child.action, child.visits) for child in self.root.children]
+        elif self.search_mode == SEARCH_BEAM:
+            self.beam_think()
+            visits = []
+        else:
+            self.random_think()
+            visits = []
+        return self.best_score, list(self.bestTurn.actions), visits
 
-        action = Action()
-        action.pick(idx=bestPick)
-        self.bestTurn.actions.append(action)
-        self.drafted_cards.append(self.state.cards[bestPick])
-        self.draft_turns += 1
+    @staticmethod
+    def plan_attacks(state, player_idx=0, plans=None, deadline_ns=None):
+        """
+        Packed attacks of the CombatPlanner for the ready creatures of the player, planned until deadline_ns.
+        plans caches them by the planner's input, the creatures and the hp of the player attacked.
+        """
+        data = state.data
+
+        def creatures(mask):
+            return tuple((idx, data[state.o_attack + idx], data[state.o_defense + idx], data[state.o_keywords + idx])
+                         for idx in mask_to_idxs(mask))
+
+        attackers = creatures(data[READY_MASKS[player_idx]])
+        defenders = creatures(data[BOARD_MASKS[1 - player_idx]])
+        hp = state.hp(1 - player_idx)
+        if plans is not None:
+            key = (attackers, defenders, hp)
+            attacks = plans.get(key)
+            if attacks is not None: return attacks
+        attacks = [pack_action(A_ATTACK, idx, target)
+                   for idx, target in CombatPlanner(attackers, defenders, deadline_ns).best_attacks(hp)]
+        if plans is not None: plans.put(key, attacks)
+        return attacks
+
+    def reply(self, state, score, alpha):
+        """
+        Two-ply score of a final position: its eval_score after the opponent's best attacks with its board
+        (its hand is unknown), planned by the CombatPlanner from its side and played by update_action() for
+        player 1. The reply can only lower the score, so as in alpha-beta a position whose score is not above
+        alpha, the best turn so far, is cut off without looking at it. The replies are cached by position, the
+        attack plans by their input.
+        """
+        if not TWO_PLY or math.isinf(score) or not state.data[OPPONENT_READY]: return score
+        if score <= alpha:
+            if STATS: _stats.reply_cutoffs += 1
+            return score
+        position = state.hash
+        cached = self.reply_scores.get(position)
+        if cached is not None: return cached
+        # Out of time, a position is not taken without its reply
+        if alpha > -float('inf') and time.perf_counter_ns() >= self.timeout.deadline_ns - REPLY_RESERVE_NS:
+            return alpha
+        if STATS: _stats.replies += 1
+        attacks = self.plan_attacks(state, player_idx=1, plans=self.attack_plans,
+                                    deadline_ns=min(self.timeout.deadline_ns, time.perf_counter_ns() + REPLY_PLAN_NS))
+        if attacks:
+            for action in attacks:
+                state.update_action(action, player_idx=1)
+            score = self.evaluate(state)
+            for _ in attacks:
+                state.undo()
+        self.reply_scores.put(position, score)
+        return score
+
+    def start_workers(self):
+        # fork gives the workers this module as it is, with nothing to import again
+        methods = multiprocessing.get_all_start_methods()
+        self.pool = multiprocessing.get_context('fork' if 'fork' in methods else None).Pool(PARALLEL_WORKERS)
+        atexit.register(self.pool.terminate)
+
+    def parallel_think(self):
+        """
+        Root parallelism: the PARALLEL_WORKERS processes search the packed position with their own random
+        streams while this one searches it too, all of them until PARALLEL_MERGE_NS before the deadline.
+        The best turn by eval_score is played, except for MCTS where the root action with the most visits
+        over all the trees is played first, with the best turn found starting with it.
+        """
+        deadline_ns = self.timeout.deadline_ns
+        blob = self.state.pack()
+        jobs = [self.pool.apply_async(search_worker,
+                                      (blob, deadline_ns - PARALLEL_MERGE_NS, self.search_mode, random.getrandbits(62)))
+                for _ in range(PARALLEL_WORKERS)]
+
+        self.timeout.deadline_ns = deadline_ns - PARALLEL_MERGE_NS
+        results = [self.search()]
+        self.timeout.deadline_ns = deadline_ns
+
+        for job in jobs:
+            try:
+                results.append(job.get(max(0.0, self.timeout.remaining() - PARALLEL_MERGE_NS / 2e9)))
+            except multiprocessing.TimeoutError:
+                log("search worker late, its result is dropped", LOG_ERROR)
+            except Exception as e:
+                log("search worker failed: {}".format(e), LOG_ERROR)
+
+        best_score, best_actions, _ = max(results, key=lambda result: result[0])
+        if self.search_mode == SEARCH_MCTS:
+            visits = {}
+            for _, _, children in results:
+                for action, count in children:
+                    visits[action] = visits.get(action, 0) + count
+            if visits:
+                action = max(visits, key=visits.get)
+                starting = [result for result in results if result[1] and result[1][0] == action]
+                if starting: best_score, best_actions, _ = max(starting, key=lambda result: result[0])
+
+        self.best_score = best_score
+        self.bestTurn.actions = best_actions
 
     def advanced_think(self):
 
         self.bestTurn.clear()
+        self.scores.clear()
+        # The workers start on the first turn, which has the long time budget
+        if PARALLEL_WORKERS and self.pool is None: self.start_workers()
 
         if self.state.isInDraft():
-            if self.draft_turns <= 20:
-                self.draft_by_card()
-            else:
-                self.draft()
-        else:
-
-            best_score = -float('inf')
-            self.bestTurn.clear()
+            self.draft()
+            self.timeout.mark(PHASE_DRAFT)
+            return
 
-            while not self.timeout.is_elapsed(MAX_SPAN_SECONDS):
-                new_state = self.state
-                turn = Turn()
-                while True:
+        if LETHAL_SOLVER:
+            lethal = LethalSolver(self.state, min(self.timeout.deadline_ns,
+                                                  time.perf_counter_ns() + LETHAL_BUDGET_NS)).solve()
+            self.timeout.mark(PHASE_LETHAL)
+            if lethal is not None:
+                log("lethal found", LOG_DEBUG)
+                self.bestTurn.actions = lethal
+                self.best_score = float('inf')
+                return
+
+        if PARALLEL_WORKERS and self.search_mode != SEARCH_BEAM:
+            self.parallel_think()
+        else:
+            self.search()
+        self.timeout.mark(PHASE_SEARCH)
 
-                    action = self.getRandomAction(copy.deepcopy(new_state))
 
-                    if action is None:
-                        break
-                    # log("RESULT: {} {} {}".format(action.type, self.state.cards[action.idx].id, self.state.cards[action.idxTarget].id))
+_worker_agent = None  # Agent of a search worker process, kept from turn to turn
 
-                    turn.actions.append(action)
-                    new_state.update_action(action=action, player_idx=0)
 
-                score = self.eval_score(new_state)
-                if score > best_score:
-                    best_score = score
-                    self.bestTurn = turn
+def search_worker(blob, deadline_ns, search_mode, seed):
+    """
+    Search a position packed by State.pack() in a worker process until deadline_ns (perf_counter_ns is the
+    same clock in every process), returns Agent.search()
+    """
+    global _worker_agent
+    if _worker_agent is None: _worker_agent = Agent(search_mode)
+    agent = _worker_agent
+    agent.search_mode = search_mode
+    agent.state = State.unpack(blob)
+    agent.bestTurn = Turn()
+    agent.scores.clear()
+    random.seed(seed)
+    agent.timeout.start()
+    agent.timeout.deadline_ns = deadline_ns
+    return agent.search()
 
 
 if __name__ == '__main__':
     agent = Agent()
+    # The objects of the start, the modules and the tables, live to the end: the garbage collector skips them,
+    # they made each of its full runs take 5 ms more in the middle of a search
+    gc.freeze()
     while True:
         agent.read()
         agent.debug()
         agent.advanced_think()
         agent.print()
+        flush_log()
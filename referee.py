@@ -0,0 +1,620 @@
+"""
+Local referee for Legends of Code and Magic.
+
+Plays games between two bot programs over the arena's stdin/stdout protocol, offline:
+
+    python referee.py main.py heuristic_bot.py --games 100 --seed 1
+
+A bot is a path to a .py file (run with this interpreter) or any shell command.
+The cards come from a cardlist file in the official format (--cards) or from a procedural pool built from a seed.
+"""
+import argparse
+import os
+import random
+import select
+import shlex
+import subprocess
+import sys
+import time
+
+""" Rules """
+STARTING_HP = 30
+RUNE_STEP = 5  # runes at 25, 20, 15, 10 and 5 health
+MAX_MANA = 12
+MAX_HAND = 8
+MAX_CREATURES_IN_PLAY = 6
+DRAFT_TURNS = 30
+CARDS_PER_DRAFT = 3
+INITIAL_HAND = (4, 5)  # the second player gets a card more...
+INITIAL_BONUS_MANA = (0, 1)  # ...and a mana more until it spends all of its mana in a turn
+MAX_TURNS = 200  # battle turns of both players before the game is called a draw
+
+""" Time limits of an answer, the first draft turn and the first battle turn of a player get the long one """
+FIRST_TURN_MS = 1000
+TURN_MS = 100
+NO_TIME_LIMIT_SECONDS = 3600.0  # wait for an answer when the time limits are off
+
+""" Card types """
+CREATURE = 0
+GREEN_ITEM = 1
+RED_ITEM = 2
+BLUE_ITEM = 3
+
+TYPE_NAMES = {'creature': CREATURE, 'itemGreen': GREEN_ITEM, 'itemRed': RED_ITEM, 'itemBlue': BLUE_ITEM}
+
+""" Card locations, seen from the player the input is sent to """
+OPPONENT_BOARD = -1
+IN_HAND = 0
+MY_BOARD = 1
+
+OPPONENT_FACE = -1
+
+""" Keywords, bit i of the mask is the i-th letter of the abilities string 'BCDGLW' """
+KW_BREAKTHROUGH = 1
+KW_CHARGE = 2
+KW_DRAIN = 4
+KW_GUARD = 8
+KW_LETHAL = 16
+KW_WARD = 32
+
+ABILITY_LETTERS = 'BCDGLW'
+
+""" Procedural card pool """
+CARD_POOL_SEED = 0
+POOL_COMPOSITION = ((CREATURE, 116), (GREEN_ITEM, 18), (RED_ITEM, 16), (BLUE_ITEM, 10))
+KEYWORD_CHANCE = 0.12  # chance of each keyword on a generated creature
+
+""" Game endings """
+END_HP = "hp"
+END_TIMEOUT = "timeout"
+END_CRASH = "crash"
+END_TURN_LIMIT = "turn_limit"
+
+
+def abilities_mask(abilities):
+    mask = 0
+    for bit, letter in enumerate(ABILITY_LETTERS):
+        if letter in abilities: mask |= 1 << bit
+    return mask
+
+
+def abilities_string(mask):
+    return ''.join(letter if mask >> bit & 1 else '-' for bit, letter in enumerate(ABILITY_LETTERS))
+
+
+class CardDef:
+    """
+    A card of the pool, as printed
+    """
+
+    def __init__(self, number, card_type, cost, attack, defense, keywords, hp_change, hp_change_enemy, card_draw):
+        self.number = number
+        self.card_type = card_type
+        self.cost = cost
+        self.attack = attack
+        self.defense = defense
+        self.keywords = keywords
+        self.hp_change = hp_change
+        self.hp_change_enemy = hp_change_enemy
+        self.card_draw = card_draw
+
+
+class CardInstance:
+    """
+    A card of a deck during the battle, its attack, defense and keywords change on the board
+    """
+
+    def __init__(self, card, instance_id):
+        self.card = card
+        self.instance_id = instance_id
+        self.attack = card.attack
+        self.defense = card.defense
+        self.keywords = card.keywords
+        self.can_attack = False
+
+    def line(self, location):
+        card = self.card
+        return "{} {} {} {} {} {} {} {} {} {} {}".format(card.number, self.instance_id, location, card.card_type,
+                                                         card.cost, self.attack, self.defense,
+                                                         abilities_string(self.keywords), card.hp_change,
+                                                         card.hp_change_enemy, card.card_draw)
+
+
+def load_cards(path):
+    """
+    Read a cardlist in the official format: number ; name ; type ; cost ; attack ; defense ; abilities ;
+    myHealthChange ; opponentHealthChange ; cardDraw ; text
+    """
+    cards = []
+    with open(path) as f:
+        for line in f:
+            fields = [field.strip() for field in line.split(';')]
+            if len(fields) < 10: continue
+            cards.append(CardDef(int(fields[0]), TYPE_NAMES[fields[2]], int(fields[3]), int(fields[4]),
+                                 int(fields[5]), abilities_mask(fields[6]), int(fields[7]), int(fields[8]),
+                                 int(fields[9])))
+    return cards
+
+
+def generate_card(rng, number, card_type):
+    """
+    A card whose stats follow its cost, about 2 points of attack or defense per mana
+    """
+    keywords = hp_change = hp_change_enemy = card_draw = 0
+    if card_type == CREATURE:
+        cost = min(MAX_MANA, int(rng.expovariate(1 / 3.5)))
+        budget = 2 * cost + 1
+        for bit in range(len(ABILITY_LETTERS)):
+            if rng.random() < KEYWORD_CHANCE:
+                keywords |= 1 << bit
+                budget -= 1
+        effect = rng.random()
+        if effect < 0.08:
+            card_draw = 1
+            budget -= 2
+        elif effect < 0.14:
+            hp_change = rng.randint(1, 3)
+            budget -= 1
+        elif effect < 0.20:
+            hp_change_enemy = -rng.randint(1, 2)
+            budget -= 1
+        budget = max(1, budget)
+        attack = rng.randint(0, budget - 1)
+        return CardDef(number, card_type, cost, attack, budget - attack, keywords, hp_change, hp_change_enemy,
+                       card_draw)
+
+    cost = min(8, int(rng.expovariate(1 / 2.5)))
+    budget = 2 * cost + 1
+    if card_type == GREEN_ITEM:
+        if rng.random() < 0.3:
+            keywords = 1 << rng.randrange(len(ABILITY_LETTERS))
+            budget -= 1
+        attack = rng.randint(0, max(0, budget))
+        defense = max(0, budget - attack)
+    elif card_type == RED_ITEM:
+        if rng.random() < 0.25:
+            keywords = (1 << len(ABILITY_LETTERS)) - 1 if rng.random() < 0.5 else 1 << rng.randrange(6)
+            budget -= 1
+        attack = -rng.randint(0, max(0, budget) // 2)
+        defense = -max(0, budget + attack)
+    else:
+        attack = 0
+        defense = 0
+        effect = rng.random()
+        if effect < 0.5:
+            defense = -(cost + 1)  # damage to the opponent or an enemy creature
+        elif effect < 0.75:
+            hp_change = budget
+        else:
+            hp_change_enemy = -cost
+            card_draw = 1
+    return CardDef(number, card_type, cost, attack, defense, keywords, hp_change, hp_change_enemy, card_draw)
+
+
+def generate_cards(seed=CARD_POOL_SEED):
+    """
+    A procedural pool shaped like the official one: 160 cards, mostly creatures
+    """
+    rng = random.Random(seed)
+    cards = []
+    for card_type, count in POOL_COMPOSITION:
+        for _ in range(count):
+            cards.append(generate_card(rng, len(cards) + 1, card_type))
+    return cards
+
+
+def bot_command(spec):
+    """
+    The command line of a bot: a .py file runs with this interpreter, anything else is a shell command
+    """
+    if spec.endswith('.py') and os.path.isfile(spec): return [sys.executable, spec]
+    return shlex.split(spec)
+
+
+class BotProcess:
+    """
+    A bot program, fed its input on stdin and answering one line per turn on stdout
+    """
+
+    def __init__(self, command, stderr=subprocess.DEVNULL):
+        # Python bots flush their output as in the arena, where stdout is not block buffered
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, env=env)
+        self.buffer = b''
+
+    def send(self, lines):
+        self.process.stdin.write(('\n'.join(lines) + '\n').encode())
+        self.process.stdin.flush()
+
+    def receive(self, timeout_seconds):
+        """
+        The next line of output, None if it is not there within timeout_seconds
+        """
+        deadline = time.perf_counter() + timeout_seconds
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self.buffer:
+            left = deadline - time.perf_counter()
+            if left <= 0: return None
+            ready, _, _ = select.select([fd], [], [], left)
+            if not ready: return None
+            chunk = os.read(fd, 1 << 16)
+            if not chunk: raise EOFError("bot exited")
+            self.buffer += chunk
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line.decode(errors='replace').strip()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class PlayerState:
+    def __init__(self, player_idx):
+        self.hp = STARTING_HP
+        self.max_mana = 0
+        self.mana = 0
+        self.bonus_mana = INITIAL_BONUS_MANA[player_idx]
+        self.next_rune = STARTING_HP - RUNE_STEP
+        self.draw = 1  # cards drawn at the start of the next turn
+        self.picks = []
+        self.deck = []
+        self.hand = []
+        self.board = []
+        self.actions = []  # "cardNumber ACTION" lines of the last turn, shown to the opponent
+        self.turns = 0  # battle turns played
+
+    def change_hp(self, amount):
+        """
+        Gain or lose health, each rune crossed gives a card more at the next draw
+        """
+        self.hp += amount
+        while self.next_rune > 0 and self.hp <= self.next_rune:
+            self.next_rune -= RUNE_STEP
+            self.draw += 1
+
+    def draw_cards(self):
+        count = self.draw
+        self.draw = 1
+        for _ in range(count):
+            if not self.deck:
+                # Drawing from an empty deck breaks the next rune
+                self.change_hp(min(0, self.next_rune - self.hp))
+            elif len(self.hand) < MAX_HAND:
+                self.hand.append(self.deck.pop())
+
+    def line(self, mana):
+        return "{} {} {} {} {}".format(self.hp, mana, len(self.deck), self.next_rune, self.draw)
+
+
+class GameOver(Exception):
+    def __init__(self, winner, reason):
+        super().__init__(reason)
+        self.winner = winner
+        self.reason = reason
+
+
+class Game:
+    """
+    One game between two bots, bot 0 plays first. play() returns a result dict:
+        winner: 0, 1 or None for a draw
+        reason: END_HP, END_TIMEOUT, END_CRASH or END_TURN_LIMIT
+        turns: battle turns played
+        latencies: answer times of each bot in milliseconds
+        invalid: actions of each bot that were ignored
+    """
+
+    def __init__(self, bots, cards, seed, time_limits=True, time_scale=1.0):
+        self.bots = bots
+        self.cards = cards
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.time_limits = time_limits
+        self.time_scale = time_scale
+        self.players = [PlayerState(0), PlayerState(1)]
+        self.latencies = [[], []]
+        self.invalid = [0, 0]
+        self.turns = 0
+
+    def ask(self, player_idx, lines, first_turn):
+        """
+        Send a turn's input to a bot and wait for its answer
+        """
+        bot = self.bots[player_idx]
+        limit = (FIRST_TURN_MS if first_turn else TURN_MS) * self.time_scale / 1000
+        start = time.perf_counter()
+        try:
+            bot.send(lines)
+            answer = bot.receive(limit if self.time_limits else NO_TIME_LIMIT_SECONDS)
+        except (EOFError, OSError):
+            raise GameOver(1 - player_idx, END_CRASH)
+        if answer is None: raise GameOver(1 - player_idx, END_TIMEOUT)
+        self.latencies[player_idx].append((time.perf_counter() - start) * 1000)
+        return answer
+
+    def play(self):
+        try:
+            self.draft()
+            self.battle()
+            winner, reason = None, END_TURN_LIMIT
+        except GameOver as game_over:
+            winner, reason = game_over.winner, game_over.reason
+        return {'seed': self.seed, 'winner': winner, 'reason': reason, 'turns': self.turns,
+                'latencies': self.latencies, 'invalid': self.invalid}
+
+    def draft(self):
+        for turn in range(DRAFT_TURNS):
+            choices = self.rng.sample(self.cards, CARDS_PER_DRAFT)
+            card_lines = [CardInstance(card, -1).line(IN_HAND) for card in choices]
+            for player_idx, player in enumerate(self.players):
+                opponent = self.players[1 - player_idx]
+                lines = [player.line(0), opponent.line(0), "0 0", str(len(card_lines))] + card_lines
+                answer = self.ask(player_idx, lines, first_turn=turn == 0)
+                player.picks.append(choices[self.pick(player_idx, answer)])
+
+    def pick(self, player_idx, answer):
+        tokens = answer.split(';')[0].split()
+        if len(tokens) >= 2 and tokens[0].upper() == 'PICK' and tokens[1].lstrip('-').isdigit():
+            pick = int(tokens[1])
+            if 0 <= pick < CARDS_PER_DRAFT: return pick
+        elif tokens and tokens[0].upper() == 'PASS':
+            return 0
+        self.invalid[player_idx] += 1
+        return 0
+
+    def battle(self):
+        instance_id = 1
+        for player_idx, player in enumerate(self.players):
+            for card in player.picks:
+                player.deck.append(CardInstance(card, instance_id))
+                instance_id += 1
+            self.rng.shuffle(player.deck)
+            for _ in range(INITIAL_HAND[player_idx]):
+                player.hand.append(player.deck.pop())
+
+        player_idx = 0
+        while self.turns < MAX_TURNS:
+            self.play_turn(player_idx)
+            self.turns += 1
+            player_idx = 1 - player_idx
+
+    def play_turn(self, player_idx):
+        player = self.players[player_idx]
+        opponent = self.players[1 - player_idx]
+
+        player.max_mana = min(MAX_MANA, player.max_mana + 1)
+        player.mana = player.max_mana + player.bonus_mana
+        player.draw_cards()
+        self.check_end(player_idx)
+        for creature in player.board:
+            creature.can_attack = True
+
+        cards = [card.line(IN_HAND) for card in player.hand]
+        cards += [card.line(MY_BOARD) for card in player.board]
+        cards += [card.line(OPPONENT_BOARD) for card in opponent.board]
+        lines = [player.line(player.mana), opponent.line(opponent.max_mana + opponent.bonus_mana),
+                 "{} {}".format(len(opponent.hand), len(opponent.actions))]
+        lines += opponent.actions
+        lines.append(str(len(cards)))
+        lines += cards
+        answer = self.ask(player_idx, lines, first_turn=player.turns == 0)
+        player.turns += 1
+
+        player.actions = []
+        for command in answer.split(';'):
+            tokens = command.split()
+            if not tokens or tokens[0].upper() == 'PASS': continue
+            if self.apply(player_idx, tokens):
+                self.check_end(player_idx)
+            else:
+                self.invalid[player_idx] += 1
+
+        if player.bonus_mana and player.mana == 0:
+            player.bonus_mana = 0
+
+    def check_end(self, player_idx):
+        """
+        End the game when a player is dead, the one whose turn it is loses when both are
+        """
+        player = self.players[player_idx]
+        opponent = self.players[1 - player_idx]
+        if player.hp <= 0: raise GameOver(1 - player_idx, END_HP)
+        if opponent.hp <= 0: raise GameOver(player_idx, END_HP)
+
+    def apply(self, player_idx, tokens):
+        """
+        Play an action of the current player, returns False when it is not legal
+        """
+        player = self.players[player_idx]
+        opponent = self.players[1 - player_idx]
+        try:
+            command = tokens[0].upper()
+            idx = int(tokens[1])
+            target = int(tokens[2]) if len(tokens) > 2 else OPPONENT_FACE
+        except (IndexError, ValueError):
+            return False
+
+        if command == 'SUMMON':
+            card = find(player.hand, idx)
+            if card is None or card.card.card_type != CREATURE or card.card.cost > player.mana: return False
+            if len(player.board) >= MAX_CREATURES_IN_PLAY: return False
+            player.hand.remove(card)
+            player.board.append(card)
+            card.can_attack = bool(card.keywords & KW_CHARGE)
+            self.play_card(player, opponent, card)
+            player.actions.append("{} SUMMON {}".format(card.card.number, idx))
+            return True
+
+        if command == 'ATTACK':
+            attacker = find(player.board, idx)
+            if attacker is None or not attacker.can_attack: return False
+            guards = [creature for creature in opponent.board if creature.keywords & KW_GUARD]
+            if target == OPPONENT_FACE:
+                if guards: return False
+                defender = None
+            else:
+                defender = find(opponent.board, target)
+                if defender is None or guards and defender not in guards: return False
+            self.attack(player, opponent, attacker, defender)
+            player.actions.append("{} ATTACK {} {}".format(attacker.card.number, idx, target))
+            return True
+
+        if command == 'USE':
+            item = find(player.hand, idx)
+            if item is None or item.card.card_type == CREATURE or item.card.cost > player.mana: return False
+            card_type = item.card.card_type
+            if card_type == GREEN_ITEM:
+                creature = find(player.board, target)
+                if creature is None: return False
+            elif target == OPPONENT_FACE and card_type == BLUE_ITEM:
+                creature = None
+            else:
+                creature = find(opponent.board, target)
+                if creature is None: return False
+            player.hand.remove(item)
+            self.play_card(player, opponent, item)
+            self.use(opponent, item, creature)
+            player.actions.append("{} USE {} {}".format(item.card.number, idx, target))
+            return True
+
+        return False
+
+    @staticmethod
+    def play_card(player, opponent, card):
+        player.mana -= card.card.cost
+        player.change_hp(card.card.hp_change)
+        opponent.change_hp(card.card.hp_change_enemy)
+        player.draw += card.card.card_draw
+
+    def attack(self, player, opponent, attacker, defender):
+        attacker.can_attack = False
+        attack = attacker.attack
+        if defender is None:
+            if attack > 0:
+                opponent.change_hp(-attack)
+                if attacker.keywords & KW_DRAIN: player.change_hp(attack)
+            return
+
+        # Both creatures deal their damage at the same time
+        defense = defender.defense
+        dealt = damage(defender, attack, attacker.keywords & KW_LETHAL)
+        damage(attacker, defender.attack, defender.keywords & KW_LETHAL)
+        if dealt > 0:
+            if attacker.keywords & KW_BREAKTHROUGH and attack > defense:
+                opponent.change_hp(defense - attack)
+            if attacker.keywords & KW_DRAIN:
+                player.change_hp(attack)
+        remove_dead(player)
+        remove_dead(opponent)
+
+    def use(self, opponent, item, creature):
+        card = item.card
+        if creature is None:
+            if card.defense < 0: opponent.change_hp(card.defense)
+            return
+
+        if card.card_type == GREEN_ITEM:
+            creature.keywords |= card.keywords
+        else:
+            creature.keywords &= ~card.keywords
+        creature.attack = max(0, creature.attack + card.attack)
+        if card.defense > 0:
+            creature.defense += card.defense
+        else:
+            damage(creature, -card.defense)
+        for player in self.players:
+            remove_dead(player)
+
+
+def find(cards, instance_id):
+    for card in cards:
+        if card.instance_id == instance_id: return card
+    return None
+
+
+def damage(creature, amount, lethal=False):
+    """
+    Deal damage to a creature, returns the damage actually dealt (0 when a ward absorbs it)
+    """
+    if amount <= 0: return 0
+    if creature.keywords & KW_WARD:
+        creature.keywords &= ~KW_WARD
+        return 0
+    creature.defense -= amount
+    if lethal: creature.defense = min(creature.defense, 0)
+    return amount
+
+
+def remove_dead(player):
+    player.board[:] = [creature for creature in player.board if creature.defense > 0]
+
+
+def play_game(commands, cards, seed, time_limits=True, time_scale=1.0, stderr=subprocess.DEVNULL):
+    """
+    Start the two bots, play one game between them and stop them, bot 0 plays first
+    """
+    bots = [BotProcess(command, stderr) for command in commands]
+    try:
+        return Game(bots, cards, seed, time_limits, time_scale).play()
+    finally:
+        for bot in bots:
+            bot.close()
+
+
+def percentile(values, fraction):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Legends of Code and Magic games between two bots")
+    parser.add_argument('bots', nargs=2, help=".py files or shell commands")
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game, the next ones count up")
+    parser.add_argument('--cards', help="cardlist file in the official format, a procedural pool otherwise")
+    parser.add_argument('--no-time-limits', action='store_true', help="wait for the answers however long")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="multiply the time limits")
+    parser.add_argument('--stderr', action='store_true', help="show the bots' stderr")
+    args = parser.parse_args()
+
+    cards = load_cards(args.cards) if args.cards else generate_cards()
+    commands = [bot_command(bot) for bot in args.bots]
+    wins = [0, 0]
+    draws = 0
+    reasons = {}
+    latencies = [[], []]
+    invalid = [0, 0]
+    for game in range(args.games):
+        # The bots take turns at playing first
+        order = (0, 1) if game % 2 == 0 else (1, 0)
+        result = play_game([commands[bot] for bot in order], cards, args.seed + game,
+                           time_limits=not args.no_time_limits, time_scale=args.time_scale,
+                           stderr=None if args.stderr else subprocess.DEVNULL)
+        if result['winner'] is None:
+            draws += 1
+        else:
+            wins[order[result['winner']]] += 1
+        reasons[result['reason']] = reasons.get(result['reason'], 0) + 1
+        for seat, bot in enumerate(order):
+            latencies[bot] += result['latencies'][seat]
+            invalid[bot] += result['invalid'][seat]
+        print("game {} seed {}: {} ({}, {} turns)".format(
+            game, args.seed + game, "draw" if result['winner'] is None else args.bots[order[result['winner']]],
+            result['reason'], result['turns']), flush=True)
+
+    print("{} wins {}, {} wins {}, draws {}".format(args.bots[0], wins[0], args.bots[1], wins[1], draws))
+    print("endings: " + ", ".join("{} {}".format(reason, count) for reason, count in sorted(reasons.items())))
+    for bot in range(2):
+        print("{} answer ms: p50 {:.1f} p95 {:.1f} max {:.1f}, invalid actions {}".format(
+            args.bots[bot], percentile(latencies[bot], 0.5), percentile(latencies[bot], 0.95),
+            max(latencies[bot], default=0.0), invalid[bot]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Tournament between bots on the local referee, with the games spread over worker processes.
+
+    python tournament.py --bot search main.py --bot mcts main.py SEARCH_MODE=mcts \
+        --bot heuristic heuristic_bot.py --games 200 --out results.jsonl
+
+Every pair of bots plays --games games: each seed is played twice, once from each seat, so both bots get the
+same draft offers. Each game is appended to --out as one JSON line as soon as it ends, with the commands the bots
+ran. Running the same command again skips the games already in the file, so an interrupted run resumes where it
+stopped. A file holding games of a bot of the same name run with another command, other overrides or another time
+scale is refused rather than mixed with the new games.
+
+A bot is a name, a .py file or shell command, and NAME=VALUE overrides of the file's module-level constants.
+"""
+import argparse
+import ast
+import json
+import math
+import multiprocessing
+import os
+import sys
+import types
+
+import referee
+
+Z_95 = 1.96  # normal quantile of the 95% confidence intervals
+ELO_PRIOR_DRAWS = 1  # virtual draws between every pair, keeps the ratings finite for a bot without wins
+ELO_ITERATIONS = 200
+MAX_SCORE = 0.999  # a score of 0 or 1 has no finite Elo difference
+PROGRESS_EVERY = 10  # games between two progress lines
+
+_cards = None  # card pool of a worker
+
+
+def run_bot(path, overrides):
+    """
+    Run the bot file as __main__, with the module-level assignments of the overridden constants
+    replaced by the given values
+    """
+    values = {}
+    for override in overrides:
+        name, _, text = override.partition('=')
+        try:
+            values[name] = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            values[name] = text  # a bare word is a string
+
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    missing = set(values)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+                and node.targets[0].id in values:
+            node.value = ast.Constant(values[node.targets[0].id])
+            missing.discard(node.targets[0].id)
+    if missing: sys.exit("{} has no constant {}".format(path, ", ".join(sorted(missing))))
+    ast.fix_missing_locations(tree)
+
+    # The bot runs as the registered __main__ module, so pickle finds its functions (the search workers' jobs)
+    module = types.ModuleType('__main__')
+    module.__file__ = path
+    sys.modules['__main__'] = module
+    sys.argv = [path]
+    exec(compile(tree, path, 'exec'), module.__dict__)
+
+
+def bot_command(spec, overrides):
+    if not overrides: return referee.bot_command(spec)
+    return [sys.executable, os.path.abspath(__file__), '--run-bot', spec] + overrides
+
+
+def init_worker(cards_path):
+    global _cards
+    _cards = referee.load_cards(cards_path) if cards_path else referee.generate_cards()
+
+
+def play(job):
+    """
+    Play one game in a worker, returns its record
+    """
+    result = referee.play_game([job['commands'][0], job['commands'][1]], _cards, job['seed'],
+                               time_scale=job['time_scale'])
+    winner = None if result['winner'] is None else job['players'][result['winner']]
+    latencies = result['latencies']
+    return {'players': job['players'], 'seed': job['seed'], 'commands': job['commands'],
+            'time_scale': job['time_scale'], 'winner': winner, 'reason': result['reason'],
+            'turns': result['turns'], 'invalid': result['invalid'],
+            'max_latency_ms': [round(max(latency, default=0.0), 2) for latency in latencies],
+            'mean_latency_ms': [round(sum(latency) / max(1, len(latency)), 2) for latency in latencies]}
+
+
+def game_key(players, seed):
+    return players[0], players[1], seed
+
+
+def stale_bots(records, commands, time_scale):
+    """
+    Names of the bots with games in the records played with another command or time scale than now
+    """
+    stale = set()
+    for record in records:
+        for seat, name in enumerate(record['players']):
+            if name not in commands: continue
+            if record.get('commands', (None, None))[seat] != commands[name] or \
+                    record.get('time_scale') != time_scale:
+                stale.add(name)
+    return sorted(stale)
+
+
+def load_records(path):
+    records = []
+    if not os.path.exists(path): return records
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass  # the last line of an interrupted run may be cut
+    return records
+
+
+def schedule(names, games, seed, commands, time_scale):
+    """
+    Every pair plays (games + 1) // 2 seeds from both seats
+    """
+    jobs = []
+    for i, first in enumerate(names):
+        for second in names[i + 1:]:
+            for game in range((games + 1) // 2):
+                for players in ((first, second), (second, first)):
+                    jobs.append({'players': list(players), 'seed': seed + game, 'time_scale': time_scale,
+                                 'commands': [commands[players[0]], commands[players[1]]]})
+    return jobs
+
+
+def score_interval(wins, draws, losses):
+    """
+    Mean score (a draw is half a win) and its 95% confidence interval
+    """
+    n = wins + draws + losses
+    if n == 0: return 0.5, 0.0, 1.0
+    score = (wins + draws / 2) / n
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / n
+    margin = Z_95 * math.sqrt(variance / n)
+    return score, max(0.0, score - margin), min(1.0, score + margin)
+
+
+def elo_difference(score):
+    score = min(MAX_SCORE, max(1 - MAX_SCORE, score))
+    return -400 * math.log10(1 / score - 1)
+
+
+def fit_elo(names, records):
+    """
+    Bradley-Terry ratings of all the bots at once (minorization-maximization), on the Elo scale with mean 0
+    """
+    points = {name: 0.0 for name in names}
+    games = {(a, b): 0 for a in names for b in names if a != b}
+    for a in names:
+        for b in names:
+            if a != b:
+                games[a, b] += ELO_PRIOR_DRAWS
+                points[a] += ELO_PRIOR_DRAWS / 2
+    for record in records:
+        a, b = record['players']
+        if a not in points or b not in points: continue
+        games[a, b] += 1
+        games[b, a] += 1
+        if record['winner'] is None:
+            points[a] += 0.5
+            points[b] += 0.5
+        else:
+            points[record['winner']] += 1
+
+    strength = {name: 1.0 for name in names}
+    for _ in range(ELO_ITERATIONS):
+        for a in names:
+            total = sum(games[a, b] / (strength[a] + strength[b]) for b in names if b != a)
+            strength[a] = points[a] / total
+    ratings = {name: 400 * math.log10(strength[name]) for name in names}
+    mean = sum(ratings.values()) / len(ratings)
+    return {name: rating - mean for name, rating in ratings.items()}
+
+
+def report(names, records):
+    lines = []
+    totals = {name: [0, 0, 0] for name in names}  # wins, draws, losses
+    pairs = {}
+    reasons = {}
+    max_latency = {name: 0.0 for name in names}
+    for record in records:
+        a, b = record['players']
+        if a not in totals or b not in totals: continue
+        reasons[record['reason']] = reasons.get(record['reason'], 0) + 1
+        for seat, name in enumerate(record['players']):
+            max_latency[name] = max(max_latency[name], record['max_latency_ms'][seat])
+        for name, opponent in ((a, b), (b, a)):
+            outcome = 1 if record['winner'] is None else 0 if record['winner'] == name else 2
+            totals[name][outcome] += 1
+            pair = pairs.setdefault((name, opponent), [0, 0, 0])
+            pair[outcome] += 1
+
+    ratings = fit_elo(names, records)
+    lines.append("{:<16} {:>7} {:>6} {:>22} {:>10}".format("bot", "elo", "games", "score (95% CI)", "max ms"))
+    for name in sorted(names, key=lambda name: -ratings[name]):
+        wins, draws, losses = totals[name]
+        score, low, high = score_interval(wins, draws, losses)
+        lines.append("{:<16} {:>7.1f} {:>6} {:>8.3f} [{:.3f}, {:.3f}] {:>10.1f}".format(
+            name, ratings[name], wins + draws + losses, score, low, high, max_latency[name]))
+
+    lines.append("")
+    lines.append("{:<16} {:<16} {:>6} {:>22} {:>24}".format("bot", "opponent", "games", "score (95% CI)",
+                                                          "elo diff (95% CI)"))
+    for (name, opponent), (wins, draws, losses) in sorted(pairs.items()):
+        score, low, high = score_interval(wins, draws, losses)
+        lines.append("{:<16} {:<16} {:>6} {:>8.3f} [{:.3f}, {:.3f}] {:>7.1f} [{:.1f}, {:.1f}]".format(
+            name, opponent, wins + draws + losses, score, low, high, elo_difference(score), elo_difference(low),
+            elo_difference(high)))
+
+    lines.append("")
+    lines.append("endings: " + ", ".join("{} {}".format(reason, count) for reason, count in sorted(reasons.items())))
+    return '\n'.join(lines)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--run-bot':
+        run_bot(sys.argv[2], sys.argv[3:])
+        return
+
+    parser = argparse.ArgumentParser(description="Round robin tournament between bots on the local referee")
+    parser.add_argument('--bot', nargs='+', action='append', required=True, metavar="NAME SPEC [NAME=VALUE]",
+                        help="a bot: its name, a .py file or command, and constants to override")
+    parser.add_argument('--games', type=int, default=100, help="games of each pair of bots")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='tournament.jsonl', help="results, one game per line")
+    parser.add_argument('--cards', help="cardlist file in the official format, a procedural pool otherwise")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="games played at the same time")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="multiply the referee's time limits")
+    parser.add_argument('--report', action='store_true', help="only print the report of the results file")
+    args = parser.parse_args()
+
+    names = []
+    commands = {}
+    for bot in args.bot:
+        if len(bot) < 2: parser.error("--bot needs a name and a file or command")
+        name, spec, overrides = bot[0], bot[1], bot[2:]
+        if name in commands: parser.error("two bots named " + name)
+        names.append(name)
+        commands[name] = bot_command(spec, overrides)
+    if len(names) < 2: parser.error("at least two bots are needed")
+
+    records = load_records(args.out)
+    stale = stale_bots(records, commands, args.time_scale)
+    if stale:
+        parser.error("{} has games of {} with another command or time scale, use another --out".format(
+            args.out, ", ".join(stale)))
+    if not args.report:
+        done = {game_key(record['players'], record['seed']) for record in records}
+        jobs = [job for job in schedule(names, args.games, args.seed, commands, args.time_scale)
+                if game_key(job['players'], job['seed']) not in done]
+        print("{} games to play, {} already in {}".format(len(jobs), len(records), args.out), flush=True)
+
+        with open(args.out, 'a') as out, \
+                multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(args.cards,)) as pool:
+            for count, record in enumerate(pool.imap_unordered(play, jobs), 1):
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+                records.append(record)
+                if count % PROGRESS_EVERY == 0 or count == len(jobs):
+                    print("{}/{} games".format(count, len(jobs)), flush=True)
+
+    print(report(names, records))
+
+
+if __name__ == '__main__':
+    main()